@@ -1,57 +1,321 @@
 import argparse
+import json
 import os
 import pathlib
 import re
-from dataclasses import dataclass
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from profiling import profiled
+from result_cache import DEFAULT_MAX_BYTES, ResultCache, cache_key
+from sequtils_store import file_digest, read_sequtils, store_chunks
+from target_regions import TargetIndex, load_targets
 
 
-@dataclass
-class BedParse:
-    contig: str
-    start: str
-    stop: str
-    fwd_cov: str
-    rev_cov: str
+def lqr_mask(fwd_cov: np.ndarray, rev_cov: np.ndarray, qv: float) -> np.ndarray:
+    """
+    :param fwd_cov: Forward coverage of positions
+    :param rev_cov: Reverse coverage of positions
+    :param qv: The quality threshold
+    :return: boolean np.array, True for positions with low sequencing quality
+    """
+    return (fwd_cov < qv) | ((fwd_cov >= qv) & (rev_cov < qv))
+
+
+def text_chunks(input_file: pathlib.PosixPath,
+                chunk_size: int = 1_000_000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, Callable]]:
+    """
+    :param input_file: The path to a BED file after sequtils
+    :param chunk_size: The number of rows processed at once
+    :return: iterator over forward coverage, reverse coverage, length of regions and a function selecting rows of
+    a chunk
+    """
+    for chunk in read_sequtils(input_file, chunk_size):
+        fwd_cov = pd.to_numeric(chunk["fwd_cov"]).to_numpy(dtype=float)
+        rev_cov = pd.to_numeric(chunk["rev_cov"]).to_numpy(dtype=float)
+        # Sequtils stop position is inclusive
+        length = (chunk["stop"] + 1 - chunk["start"]).to_numpy()
+        yield fwd_cov, rev_cov, length, lambda mask, chunk=chunk: chunk.loc[mask]
+
+
+def lqr_key(fwd_cov: np.ndarray, rev_cov: np.ndarray) -> np.ndarray:
+    """
+    :param fwd_cov: Forward coverage of positions
+    :param rev_cov: Reverse coverage of positions
+    :return: np.array, the position is a LQR for every quality threshold above this value (see lqr_mask)
+    """
+    fwd_cov = np.asarray(fwd_cov, dtype=float)
+    return np.where(np.isnan(fwd_cov), np.inf, np.fmin(fwd_cov, rev_cov))
+
+
+def sweep_lengths(fwd_cov: np.ndarray, rev_cov: np.ndarray, length: np.ndarray,
+                  thresholds: np.ndarray) -> np.ndarray:
+    """
+    :param fwd_cov: Forward coverage of positions
+    :param rev_cov: Reverse coverage of positions
+    :param length: Length of regions
+    :param thresholds: Sorted quality thresholds
+    :return: the total length of LQRs for each quality threshold
+    """
+    key = lqr_key(fwd_cov, rev_cov)
+    order = np.argsort(key, kind="stable")
+    cumulative = np.concatenate([[0], np.cumsum(length[order])])
+    return cumulative[np.searchsorted(key[order], thresholds, side="left")]
+
+
+def count_lqr(qv: int, input_file: pathlib.PosixPath, output_file: pathlib.PosixPath,
+              chunk_size: int = 1_000_000, store_dir: Optional[pathlib.PosixPath] = None,
+              thresholds: Optional[List[int]] = None,
+              targets: Optional[TargetIndex] = None) -> Tuple[int, np.ndarray, np.ndarray]:
+    """
+    :param qv: The quality threshold
+    :param input_file: The path to a BED file after sequtils
+    :param output_file: The path to an output BED file with LQRs
+    :param chunk_size: The number of rows processed at once
+    :param store_dir: The path to the binary store of sequtils results, if set the file is read from the store
+    :param thresholds: Quality thresholds for the sweep, counted in the same pass
+    :param targets: Index of target regions, if set LQR positions are counted for each target region
+    :return: the total length of LQRs, the total length of LQRs for each threshold of the sweep and the number of
+    LQR positions in each target region
+    """
+    chunks = store_chunks(input_file, store_dir, chunk_size) if store_dir is not None else None
+    if chunks is None:
+        chunks = text_chunks(input_file, chunk_size)
+    thresholds = np.sort(np.asarray(thresholds if thresholds is not None else [], dtype=float))
+    lqr_length = 0
+    sweep = np.zeros(thresholds.shape[0], dtype=np.int64)
+    target_counts = targets.counts() if targets is not None else None
+    with open(output_file, "w") as lqr_file:
+        for fwd_cov, rev_cov, length, select_rows in chunks:
+            mask = lqr_mask(fwd_cov, rev_cov, qv)
+            lqr_length += int(length[mask].sum())
+            # Sequtils stop position is inclusive, LQR file stop position is not
+            lqr = select_rows(mask)
+            lqr = lqr.assign(stop=lqr["stop"] + 1)
+            lqr.to_csv(lqr_file, sep="\t", header=False, index=False)
+            if thresholds.shape[0]:
+                sweep += sweep_lengths(fwd_cov, rev_cov, length, thresholds)
+            if target_counts is not None:
+                target_counts.add(lqr.astype({"contig": str}))
+    if target_counts is None:
+        return lqr_length, sweep, np.zeros(0, dtype=np.int64)
+    return lqr_length, sweep, target_counts.lengths()
+
+
+def cached_count_lqr(cache: ResultCache, qv: int, input_file: pathlib.PosixPath, output_file: pathlib.PosixPath,
+                     chunk_size: int = 1_000_000, store_dir: Optional[pathlib.PosixPath] = None,
+                     thresholds: Optional[List[int]] = None,
+                     targets: Optional[TargetIndex] = None) -> Tuple[int, np.ndarray, np.ndarray]:
+    """
+    :param cache: Result cache
+    :param qv: The quality threshold
+    :param input_file: The path to a BED file after sequtils
+    :param output_file: The path to an output BED file with LQRs
+    :param chunk_size: The number of rows processed at once
+    :param store_dir: The path to the binary store of sequtils results
+    :param thresholds: Quality thresholds for the sweep
+    :param targets: Index of target regions
+    :return: the same as count_lqr, taken from the cache if the same BED file has been processed before
+    """
+    key = cache_key(kind="lqr", sequtils=file_digest(input_file, cache.cache_dir), qv=qv,
+                    thresholds=sorted(thresholds) if thresholds else [],
+                    targets=targets.digest if targets is not None else None)
+    meta = cache.restore(key, {"LQR.bed": output_file})
+    if meta is not None:
+        return meta["lqr_length"], np.array(meta["sweep"], dtype=np.int64), np.array(meta["targets"], dtype=np.int64)
+    lqr_length, sweep, target_lengths = count_lqr(qv, input_file, output_file, chunk_size, store_dir, thresholds,
+                                                  targets)
+    cache.store(key, {"LQR.bed": output_file}, {"lqr_length": lqr_length, "sweep": sweep.tolist(),
+                                                "targets": target_lengths.tolist()})
+    return lqr_length, sweep, target_lengths
+
 
-    def __str__(self) -> str:
-        return '\t'.join([self.contig, self.start, self.stop, self.fwd_cov, self.rev_cov])
+def format_proportion(value: float) -> str:
+    """
+    :param value: The proportion of LQRs
+    :return: the proportion formatted the same way as awk prints numbers
+    """
+    if value == int(value):
+        return str(int(value))
+    return f"{value:.6g}"
 
 
-def parse_bed(qv: int, input_dir: pathlib.PosixPath, output_dir: pathlib.PosixPath):
+def timed_count_lqr(qv: int, input_file: str, output_file: str, chunk_size: int = 1_000_000,
+                    store_dir: Optional[pathlib.PosixPath] = None,
+                    thresholds: Optional[List[int]] = None,
+                    targets: Optional[TargetIndex] = None,
+                    cache: Optional[ResultCache] = None) -> Tuple[int, np.ndarray, np.ndarray, float]:
     """
     :param qv: The quality threshold
+    :param input_file: The path to a BED file after sequtils
+    :param output_file: The path to an output BED file with LQRs
+    :param chunk_size: The number of rows processed at once
+    :param store_dir: The path to the binary store of sequtils results
+    :param thresholds: Quality thresholds for the sweep
+    :param targets: Index of target regions
+    :param cache: Result cache, if set the counts are reused for the same BED files
+    :return: the total length of LQRs, the total length of LQRs for each threshold of the sweep, the number of LQR
+    positions in each target region and the processing time in seconds
+    """
+    start_time = time.perf_counter()
+    if cache is None:
+        lqr_length, sweep, target_lengths = count_lqr(qv, input_file, output_file, chunk_size, store_dir,
+                                                      thresholds, targets)
+    else:
+        lqr_length, sweep, target_lengths = cached_count_lqr(cache, qv, input_file, output_file, chunk_size,
+                                                             store_dir, thresholds, targets)
+    return lqr_length, sweep, target_lengths, time.perf_counter() - start_time
+
+
+def parse_thresholds(text: str) -> List[int]:
+    """
+    :param text: Quality thresholds as a list ("2,4,8,16") or an inclusive range ("first:last:step")
+    :return: sorted list of quality thresholds
+    """
+    if ":" in text:
+        first, last, step = (int(el) for el in text.split(":"))
+        return list(range(first, last + 1, step))
+    return sorted(int(el) for el in text.split(","))
+
+
+def sequtils_files(input_dir: pathlib.PosixPath, params_file: Optional[pathlib.PosixPath] = None) -> List[str]:
+    """
     :param input_dir: The path to input files directory
-    :param output_dir: The path to output files directory
+    :param params_file: The path to JSON file with the subsampling parameters
+    :return: the list of sequtils BED file names ordered by the number of reads per amplicon
     """
     files = os.listdir(input_dir)
     filename = []
     for file in files:
         if file.endswith('sequtils.bed'):
             filename.append(file)
-    # Sort the "filename" list according to the number of reads per amplicon:
-    filename.sort(key=lambda test_string: list(map(int, re.findall(r'\d+', test_string)))[-1])
-    for input_filename in filename:
-        inp = os.path.join(input_dir, input_filename)
-        out = os.path.join(output_dir, input_filename).replace("sequtils", "LQR")
-        with open(inp, "r") as f, open(out, "w") as lqr_file:
-            table_data = [line.split() for line in f]
-            for i in table_data:
-                if (float(i[4]) < qv) or ((float(i[4]) >= qv) and (float(i[5]) < qv)):
-                    bed_string = BedParse(i[0], i[1], str(int(i[2])+1), i[4], i[5])
-                    # If the directory for input and output files contains "sequtils" -> error
-                    lqr_file.write(str(bed_string) + '\n')
+    if params_file is None:
+        # Sort the "filename" list according to the number of reads per amplicon:
+        filename.sort(key=lambda test_string: list(map(int, re.findall(r'\d+', test_string)))[-1])
+        return filename
+    # Take the point order from the subsampling parameters (one BED file per subsampling index):
+    with open(params_file, "r") as js_data:
+        points = len(json.load(js_data))
+    ordered = []
+    for index in range(points):
+        suffix = f"_sub{index}_sequtils.bed"
+        matched = [file for file in filename if file.endswith(suffix)]
+        if len(matched) != 1:
+            raise FileNotFoundError(f"Expected one file ending with {suffix} in {input_dir}, found {len(matched)}")
+        ordered.append(matched[0])
+    return ordered
+
+
+def parse_bed(qv: int, input_dir: pathlib.PosixPath, output_dir: pathlib.PosixPath,
+              total_positions: Optional[int] = None, chunk_size: int = 1_000_000,
+              params_file: Optional[pathlib.PosixPath] = None, jobs: int = 1,
+              store_dir: Optional[pathlib.PosixPath] = None, thresholds: Optional[List[int]] = None,
+              targets_file: Optional[pathlib.PosixPath] = None,
+              cache_dir: Optional[pathlib.PosixPath] = None,
+              cache_max_bytes: int = DEFAULT_MAX_BYTES) -> Tuple[Optional[List[float]], Optional[pd.DataFrame]]:
+    """
+    :param qv: The quality threshold
+    :param input_dir: The path to input files directory
+    :param output_dir: The path to output files directory
+    :param total_positions: The number of positions in target regions, if set the proportion of LQRs is counted
+    :param chunk_size: The number of rows processed at once
+    :param params_file: The path to JSON file with the subsampling parameters, defines the order of points
+    :param jobs: The number of worker processes
+    :param store_dir: The path to the binary store of sequtils results, if set BED files are read from the store
+    :param thresholds: Quality thresholds for the sweep, if set the qv x depth table of LQR proportions is saved
+    :param targets_file: The path to BED file with target regions, if set the proportion of LQRs is counted for each
+    target region
+    :param cache_dir: The path to the result cache directory, if set the counts are reused for the same BED files
+    :param cache_max_bytes: The size limit of the result cache
+    :return: the proportion of LQRs for each point and the qv x depth table of LQR proportions (if counted)
+    """
+    if thresholds and total_positions is None:
+        raise ValueError("The number of positions in target regions is required for the quality threshold sweep")
+    targets = load_targets(targets_file) if targets_file is not None else None
+    cache = ResultCache(str(cache_dir), cache_max_bytes) if cache_dir is not None else None
+    filename = sequtils_files(input_dir, params_file)
+    inputs = [os.path.join(input_dir, input_filename) for input_filename in filename]
+    # If the directory for input and output files contains "sequtils" -> error
+    outputs = [os.path.join(output_dir, input_filename).replace("sequtils", "LQR") for input_filename in filename]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(timed_count_lqr, [qv] * len(inputs), inputs, outputs,
+                                        [chunk_size] * len(inputs), [store_dir] * len(inputs),
+                                        [thresholds] * len(inputs), [targets] * len(inputs),
+                                        [cache] * len(inputs)))
+    else:
+        results = [timed_count_lqr(qv, inp, out, chunk_size, store_dir, thresholds, targets, cache)
+                   for inp, out in zip(inputs, outputs)]
+    for input_filename, (_, _, _, elapsed) in zip(filename, results):
+        print(f"LQR counting for {input_filename} took {elapsed:.2f} s")
+    # Count the proportion of LQRs for each point:
+    proportions = None
+    if total_positions is not None:
+        proportions = [length / total_positions for length, _, _, _ in results]
+        with open(os.path.join(output_dir, "lqr_proportions.txt"), "w") as prop_file:
+            for value in proportions:
+                prop_file.write(format_proportion(value) + "\n")
+    if params_file is not None:
+        with open(params_file, "r") as js_data:
+            points = [int(el) for el in json.load(js_data)]
+    else:
+        points = list(range(len(results)))
+    # Save the qv x depth table of LQR proportions:
+    surface = None
+    if thresholds:
+        surface = pd.DataFrame(np.column_stack([sweep for _, sweep, _, _ in results]) / total_positions,
+                               index=pd.Index(sorted(thresholds), name="qv"), columns=points)
+        surface.to_csv(os.path.join(output_dir, "lqr_qv_surface.txt"), sep="\t", index=True, header=True)
+    # Save the proportion of LQRs in each target region for each point:
+    if targets is not None:
+        target_length = (targets.targets["end"] - targets.targets["start"]).to_numpy()[:, None]
+        lengths = np.column_stack([lengths for _, _, lengths, _ in results])
+        # Empty target regions have no LQRs:
+        fractions = pd.DataFrame(np.divide(lengths, target_length, out=np.zeros(lengths.shape),
+                                           where=target_length > 0), columns=points)
+        pd.concat([targets.targets, fractions], axis=1).to_csv(os.path.join(output_dir, "lqr_per_target.txt"),
+                                                               sep="\t", index=False, header=True)
+    return proportions, surface
 
 
-def main(quality_threshold, input_dir, output_dir):
-    parse_bed(quality_threshold, input_dir, output_dir)
+@profiled
+def main(quality_threshold, input_dir, output_dir, total_positions=None, chunk_size=1_000_000, params_file=None,
+         jobs=1, store_dir=None, thresholds=None, targets_file=None, cache_dir=None, cache_max_gb=20):
+    parse_bed(quality_threshold, input_dir, output_dir, total_positions, chunk_size, params_file, jobs, store_dir,
+              thresholds, targets_file, cache_dir, int(cache_max_gb * 1024 ** 3))
 
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="Script for LQR counting")
     parser.add_argument("-q", "--quality_threshold", type=int, help="The quality threshold")
     parser.add_argument("-i", "--input_dir", type=lambda p: pathlib.Path(p).absolute(),
                         help="The path to input files directory")
     parser.add_argument("-o", "--output_dir", type=lambda p: pathlib.Path(p).absolute(),
                         help="The path to output files directory")
-    args = parser.parse_args()
-    main(quality_threshold=args.quality_threshold, input_dir=args.input_dir, output_dir=args.output_dir)
+    parser.add_argument("-t", "--total_positions", type=int, default=None,
+                        help="The number of positions in target regions (writes lqr_proportions.txt)")
+    parser.add_argument("-c", "--chunk_size", type=int, default=1_000_000,
+                        help="The number of BED rows processed at once")
+    parser.add_argument("-s", "--params_file", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to JSON file with the subsampling parameters (defines the order of points)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="The number of worker processes")
+    parser.add_argument("-b", "--store_dir", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to the binary store of sequtils results (BED files are converted on first use)")
+    parser.add_argument("-v", "--qv_sweep", type=parse_thresholds, default=None,
+                        help="Quality thresholds for the sweep: a list (2,4,8,16) or an inclusive range (first:last:step)")
+    parser.add_argument("-r", "--targets_file", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to BED file with target regions (writes lqr_per_target.txt)")
+    parser.add_argument("-d", "--cache_dir", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to the result cache directory (reuse counts for the same BED files)")
+    parser.add_argument("-m", "--cache_max_gb", type=float, default=20, help="The size limit of the cache in GB")
+    args = parser.parse_args(argv)
+    main(quality_threshold=args.quality_threshold, input_dir=args.input_dir, output_dir=args.output_dir,
+         total_positions=args.total_positions, chunk_size=args.chunk_size, params_file=args.params_file,
+         jobs=args.jobs, store_dir=args.store_dir, thresholds=args.qv_sweep, targets_file=args.targets_file,
+         cache_dir=args.cache_dir, cache_max_gb=args.cache_max_gb)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os.path
+import pathlib
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from LQR_counting import format_proportion
+from profiling import profiled
+from sequtils_store import read_sequtils
+
+
+def coverage_groups(input_file: pathlib.PosixPath, chunk_size: int = 1_000_000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param input_file: The path to a BED file after sequtils (full-depth BAM file)
+    :param chunk_size: The number of rows processed at once
+    :return: unique (fwd_cov, rev_cov, length) rows and the number of regions in each of them
+    """
+    groups = []
+    counts = []
+    for chunk in read_sequtils(input_file, chunk_size):
+        # Thinned coverage is binomial, so the coverage is rounded down to the whole number of reads
+        fwd_cov = np.floor(pd.to_numeric(chunk["fwd_cov"]).to_numpy(dtype=float)).astype(np.int64)
+        rev_cov = np.floor(pd.to_numeric(chunk["rev_cov"]).to_numpy(dtype=float)).astype(np.int64)
+        length = (chunk["stop"] + 1 - chunk["start"]).to_numpy(dtype=np.int64)
+        unique, count = np.unique(np.column_stack([fwd_cov, rev_cov, length]), axis=0, return_counts=True)
+        groups.append(unique)
+        counts.append(count)
+    if not groups:
+        return np.zeros((0, 3), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Merge the groups of all chunks:
+    unique, inverse = np.unique(np.concatenate(groups), axis=0, return_inverse=True)
+    count = np.bincount(inverse.ravel(), weights=np.concatenate(counts), minlength=unique.shape[0])
+    return unique, count.astype(np.int64)
+
+
+def prob_below(coverage: np.ndarray, fraction: float, qv: int) -> np.ndarray:
+    """
+    :param coverage: Full-depth coverage of regions
+    :param fraction: The fraction of reads left after subsampling
+    :param qv: The quality threshold
+    :return: probability that the binomially thinned coverage is less than qv
+    """
+    if qv <= 0:
+        return np.zeros(coverage.shape)
+    if fraction >= 1:
+        return (coverage < qv).astype(float)
+    if fraction <= 0:
+        return np.ones(coverage.shape)
+    # Sum of binomial probabilities for k = 0 .. qv - 1 reads, computed in log space:
+    log_pmf = coverage * np.log1p(-fraction)
+    log_ratio = np.log(fraction) - np.log1p(-fraction)
+    total = np.exp(log_pmf)
+    for k in range(qv - 1):
+        possible = coverage > k
+        with np.errstate(divide="ignore"):
+            log_pmf = log_pmf + np.log(np.where(possible, coverage - k, 1)) - np.log(k + 1) + log_ratio
+        total += np.where(possible, np.exp(log_pmf), 0)
+    return np.minimum(total, 1)
+
+
+def lqr_probability(groups: np.ndarray, fraction: float, qv: int) -> np.ndarray:
+    """
+    :param groups: unique (fwd_cov, rev_cov, length) rows
+    :param fraction: The fraction of reads left after subsampling
+    :param qv: The quality threshold
+    :return: probability for a region of each group to be a LQR after subsampling
+    """
+    fwd_below = prob_below(groups[:, 0], fraction, qv)
+    rev_below = prob_below(groups[:, 1], fraction, qv)
+    return 1 - (1 - fwd_below) * (1 - rev_below)
+
+
+def model_proportions(groups: np.ndarray, count: np.ndarray, fractions: List[float], qv: int, total_positions: int,
+                      replicates: int = 0, confidence: float = 0.95,
+                      seed: int = 0) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    :param groups: unique (fwd_cov, rev_cov, length) rows
+    :param count: The number of regions in each group
+    :param fractions: The fractions of reads for each point
+    :param qv: The quality threshold
+    :param total_positions: The number of positions in target regions
+    :param replicates: The number of Monte Carlo replicates for confidence bands (0 - without bands)
+    :param confidence: The confidence level of bands
+    :param seed: Random seed for Monte Carlo replicates
+    :return: expected proportion of LQRs for each point and (points x 2) array of band limits
+    """
+    length = groups[:, 2]
+    expected = np.zeros(len(fractions))
+    bands = np.zeros((len(fractions), 2)) if replicates > 0 else None
+    rng = np.random.default_rng(seed)
+    for i, fraction in enumerate(fractions):
+        prob = lqr_probability(groups, fraction, qv)
+        expected[i] = (count * length * prob).sum() / total_positions
+        if bands is not None:
+            # The number of LQR regions in each group is binomial in every replicate:
+            lqr_regions = rng.binomial(count, prob, size=(replicates, len(count)))
+            proportions = (lqr_regions * length).sum(axis=1) / total_positions
+            bands[i] = np.quantile(proportions, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return expected, bands
+
+
+def save_proportions(expected: np.ndarray, bands: Optional[np.ndarray], output_dir: pathlib.PosixPath):
+    """
+    :param expected: The expected proportion of LQRs for each point
+    :param bands: (points x 2) array of band limits or None
+    :param output_dir: The path to output files directory
+    """
+    with open(os.path.join(output_dir, "lqr_proportions.txt"), "w") as prop_file:
+        for value in expected:
+            prop_file.write(format_proportion(value) + "\n")
+    if bands is not None:
+        pd.DataFrame(bands).to_csv(os.path.join(output_dir, "lqr_proportion_bands.txt"), sep="\t", header=False,
+                                   index=False)
+
+
+@profiled
+def main(quality_threshold, input_file, params_file, total_positions, output_dir, replicates=0, confidence=0.95,
+         seed=0, chunk_size=1_000_000):
+    with open(params_file, "r") as js_data:
+        fractions = list(json.load(js_data).values())
+    groups, count = coverage_groups(input_file, chunk_size)
+    expected, bands = model_proportions(groups, count, fractions, quality_threshold, total_positions, replicates,
+                                        confidence, seed)
+    save_proportions(expected, bands, output_dir)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for modelling the LQR proportion for each point "
+                                                 "by binomial thinning of full-depth coverage")
+    parser.add_argument("-q", "--quality_threshold", type=int, help="The quality threshold")
+    parser.add_argument("-i", "--input_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to BED file after sequtils for the full-depth BAM file")
+    parser.add_argument("-s", "--params_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to JSON file with the subsampling parameters")
+    parser.add_argument("-t", "--total_positions", type=int, help="The number of positions in target regions")
+    parser.add_argument("-o", "--output_dir", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to output files directory")
+    parser.add_argument("-r", "--replicates", type=int, default=0,
+                        help="The number of Monte Carlo replicates for confidence bands (default: 0, no bands)")
+    parser.add_argument("-l", "--confidence", type=float, default=0.95, help="The confidence level of bands")
+    parser.add_argument("-e", "--seed", type=int, default=0, help="Random seed for Monte Carlo replicates")
+    parser.add_argument("-c", "--chunk_size", type=int, default=1_000_000,
+                        help="The number of BED rows processed at once")
+    args = parser.parse_args(argv)
+    main(quality_threshold=args.quality_threshold, input_file=args.input_file, params_file=args.params_file,
+         total_positions=args.total_positions, output_dir=args.output_dir, replicates=args.replicates,
+         confidence=args.confidence, seed=args.seed, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    cli()
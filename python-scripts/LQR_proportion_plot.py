@@ -1,9 +1,10 @@
 import argparse
-import matplotlib.pyplot as plt
 import pandas as pd
 import pathlib
-import seaborn as sns
 import os.path
+from typing import List, Optional
+from profiling import profiled
+from render import darkgrid, new_figure
 
 
 def table_for_plot(first_point: int, last_point: int, points: int, input_file: pathlib.PosixPath) -> pd.DataFrame:
@@ -14,50 +15,113 @@ def table_for_plot(first_point: int, last_point: int, points: int, input_file: p
     :param input_file: The path to an input file
     :return pd.DataFrame for subsequent plotting
     """
+    lqr_prop = pd.read_csv(input_file, sep="\t", header=None)
+    return proportions_table(first_point, last_point, points, lqr_prop[0].tolist())
+
+
+def proportions_table(first_point: int, last_point: int, points: int, proportions: List[float]) -> pd.DataFrame:
+    """
+    :param first_point: The first point among numbers of reads per amplicon
+    :param last_point: The last point among numbers of reads per amplicon
+    :param points: The number of points
+    :param proportions: The proportion of LQRs for each point
+    :return pd.DataFrame for subsequent plotting
+    """
     # Check the first and last points
     if last_point - first_point <= 0:
         raise ValueError("The last point is less than or equal to the first point")
     df = pd.DataFrame()
-    lqr_prop = pd.read_csv(input_file, sep="\t", header=None)
     step = (last_point - first_point) // (points - 1)
     read_per_amp = []
     for i in range(first_point, last_point + 1, step):
         read_per_amp.append(i)
     df["Reads_per_amplicon"] = read_per_amp
-    df["Proportion_of_LQRs"] = lqr_prop[0]
+    df["Proportion_of_LQRs"] = pd.Series(proportions, dtype=float)
     return df
 
 
-def lqr_plot(df: pd.DataFrame, output_dir: pathlib.PosixPath, figure_width: float, figure_height: float):
+def lqr_plot(df: pd.DataFrame, output_dir: pathlib.PosixPath, figure_width: float, figure_height: float,
+             bands: Optional[pd.DataFrame] = None):
     """
     :param figure_width: The width of the LQR plot
     :param figure_height: The height of the LQR plot
     :param df: pd.DataFrame containing the proportion of LQRs for each point
     :param output_dir: The path to an output file directory
+    :param bands: pd.DataFrame with the lower and upper confidence limits for each point
     """
-    sns.set(rc={'figure.figsize': (figure_width, figure_height)})
-    lqr = sns.lineplot(data=df, x="Reads_per_amplicon", y="Proportion_of_LQRs", color="purple")
-    lqr.set_title("Percentage of LQR in panel target regions", fontsize=20)
-    lqr.set_ylabel("Percentage", fontsize=15)
-    lqr.set_xlabel("Number of reads per amplicon", fontsize=15)
-    plt.savefig(os.path.join(output_dir, "LQR_proportion_plot.png"))
+    with darkgrid():
+        figure, lqr = new_figure(figure_width, figure_height)
+        lqr.plot(df["Reads_per_amplicon"], df["Proportion_of_LQRs"], color="purple")
+        if bands is not None:
+            lqr.fill_between(df["Reads_per_amplicon"], bands[0], bands[1], color="purple", alpha=0.2)
+        lqr.set_title("Percentage of LQR in panel target regions", fontsize=20)
+        lqr.set_ylabel("Percentage", fontsize=15)
+        lqr.set_xlabel("Number of reads per amplicon", fontsize=15)
+        figure.savefig(os.path.join(output_dir, "LQR_proportion_plot.png"))
 
 
-def main(first_point, last_point, points, input_file, output_dir, figure_width, figure_height):
-    df_for_plot = table_for_plot(first_point, last_point, points, input_file)
-    lqr_plot(df_for_plot, output_dir, figure_width, figure_height)
+def surface_plot(surface: pd.DataFrame, output_dir: pathlib.PosixPath, figure_width: float, figure_height: float,
+                 style: str = "curves"):
+    """
+    :param surface: qv x reads per amplicon table of LQR proportions
+    :param output_dir: The path to an output file directory
+    :param figure_width: The width of the plot
+    :param figure_height: The height of the plot
+    :param style: "curves" (a curve for each quality threshold) or "heatmap"
+    """
+    import matplotlib.cm
+    with darkgrid():
+        figure, plot = new_figure(figure_width, figure_height)
+        if style == "heatmap":
+            import seaborn as sns
+            sns.heatmap(surface, cmap="RdYlGn_r", rasterized=True, ax=plot)
+            plot.set_ylabel("Quality threshold", fontsize=15)
+        else:
+            # A curve for each quality threshold:
+            reads_per_amp = surface.columns.astype(int)
+            for k, (qv, proportions) in enumerate(surface.iterrows()):
+                color = matplotlib.cm.viridis(k / max(surface.shape[0] - 1, 1))
+                plot.plot(reads_per_amp, proportions.to_numpy(), color=color, label=qv)
+            plot.legend(title="qv")
+            plot.set_ylabel("Percentage", fontsize=15)
+        plot.set_title("Percentage of LQR in panel target regions for quality thresholds", fontsize=20)
+        plot.set_xlabel("Number of reads per amplicon", fontsize=15)
+        figure.savefig(os.path.join(output_dir, "LQR_qv_surface_plot.png"))
 
 
-if __name__ == "__main__":
+@profiled
+def main(first_point, last_point, points, input_file, output_dir, figure_width, figure_height, bands_file=None,
+         surface_file=None, surface_style="curves"):
+    if input_file is not None:
+        df_for_plot = table_for_plot(first_point, last_point, points, input_file)
+        bands = pd.read_csv(bands_file, sep="\t", header=None) if bands_file is not None else None
+        lqr_plot(df_for_plot, output_dir, figure_width, figure_height, bands)
+    if surface_file is not None:
+        surface = pd.read_csv(surface_file, sep="\t", header=0, index_col=0)
+        surface_plot(surface, output_dir, figure_width, figure_height, surface_style)
+
+
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="Script for plotting the LQR proportion for each point")
     parser.add_argument("-f", "--first_point", type=int, help="The first point among numbers of reads per amplicon")
     parser.add_argument("-l", "--last_point", type=int, help="The last point among numbers of reads per amplicon")
     parser.add_argument("-p", "--points", type=int, help="The number of points")
-    parser.add_argument("-i", "--input_file", help="The path to input file")
+    parser.add_argument("-i", "--input_file", default=None, help="The path to input file")
     parser.add_argument("-o", "--output_dir", type=lambda p: pathlib.Path(p).absolute(),
                         help="The path to output file directory")
     parser.add_argument("-w", "--figure_width", type=float, default=10, help="The width of the LQR plot")
     parser.add_argument("-e", "--figure_height", type=float, default=6, help="The height of the LQR plot")
-    args = parser.parse_args()
+    parser.add_argument("-b", "--bands_file", default=None,
+                        help="The path to file with confidence bands of the LQR proportion (optional)")
+    parser.add_argument("-s", "--surface_file", default=None,
+                        help="The path to qv x reads per amplicon table of LQR proportions (optional)")
+    parser.add_argument("-t", "--surface_style", choices=["curves", "heatmap"], default="curves",
+                        help="The style of the quality threshold plot")
+    args = parser.parse_args(argv)
     main(first_point=args.first_point, last_point=args.last_point, points=args.points, input_file=args.input_file,
-         output_dir=args.output_dir, figure_width=args.figure_width, figure_height=args.figure_height)
+         output_dir=args.output_dir, figure_width=args.figure_width, figure_height=args.figure_height,
+         bands_file=args.bands_file, surface_file=args.surface_file, surface_style=args.surface_style)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,12 +1,15 @@
 import argparse
 import os.path
-import matplotlib.pyplot as plt
+from contextlib import ExitStack
 import numpy as np
 import pandas as pd
 import pathlib
-import seaborn as sns
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import r2_score
+from typing import Dict, List, Optional, Tuple
+from profiling import profiled
+from render import RenderPool, darkgrid, downsample, new_figure
+
+# The number of rows of coverage analysis results read at once in the low-memory mode
+CHUNK_ROWS = 100_000
 
 
 def create_table(input_file: pathlib.PosixPath) -> pd.DataFrame:
@@ -24,6 +27,29 @@ def create_table(input_file: pathlib.PosixPath) -> pd.DataFrame:
     return data_sorted
 
 
+def fit_line(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param x: Amplicon serial numbers, shape (amplicons,)
+    :param y: Relative amplicon coverage, shape (amplicons,) or (amplicons, samples)
+    :return: slope, intercept and R2 of the ordinary least squares line for each sample
+    """
+    x = x.astype(float)
+    y = y.astype(float)
+    dx = x - x.mean()
+    y_mean = y.mean(axis=0)
+    dy = y - y_mean
+    ss_x = dx @ dx
+    slope = (dx @ dy) / ss_x if ss_x > 0 else np.zeros_like(y_mean)
+    intercept = y_mean - slope * x.mean()
+    residuals = dy - np.multiply.outer(dx, slope)
+    ss_res = (residuals ** 2).sum(axis=0)
+    ss_tot = (dy ** 2).sum(axis=0)
+    # R2 of a constant coverage profile is 1 for a perfect fit and 0 otherwise
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.where(ss_res > 0, 0.0, 1.0))
+    return slope, intercept, r2
+
+
 def lin_regression(sample_name: str, data_sorted: pd.DataFrame, threshold: int = 0.85) -> np.ndarray:
     """
     :param sample_name: use sample name in case of low R2 coefficient
@@ -31,19 +57,52 @@ def lin_regression(sample_name: str, data_sorted: pd.DataFrame, threshold: int =
     :param threshold: Threshold for R2 in linear regression
     :return: np.array containing predicted number of amplicon reads
     """
-    # Sklearn linear regression:
-    x = np.array(data_sorted['amp_serial_num']).reshape(-1, 1)
-    y = np.array(data_sorted['amp_proc']).reshape(-1, 1)
-    lin_reg = LinearRegression()
-    lin_reg.fit(x, y)
-    y_predict = lin_reg.predict(x)
-    r2 = r2_score(y, y_predict)
-    # Raise an error and stop if the observed R2 score is less than R2 threshold:
-    if r2 >= threshold:
-        return y_predict
-    else:
+    # Closed-form linear regression:
+    x = np.array(data_sorted['amp_serial_num'])
+    y = np.array(data_sorted['amp_proc'])
+    slope, intercept, r2 = fit_line(x, y)
+    y_predict = (intercept + slope * x).reshape(-1, 1)
+    # Report the sample if the observed R2 score is less than R2 threshold:
+    if r2 < threshold:
         print(f"R2 for {sample_name} coverage results is less than threshold {threshold}")
-        return y_predict
+    return y_predict
+
+
+def cohort_matrix(input_files: List[pathlib.PosixPath]) -> Tuple[List[pd.DataFrame], np.ndarray]:
+    """
+    :param input_files: The paths to VariFind or Oncoscope coverage analysis results
+    :return: the list of input pd.DataFrames and amplicons x samples matrix of the total number of reads
+    """
+    tables = [pd.read_csv(input_file, sep="\t") for input_file in input_files]
+    if len({table.shape[0] for table in tables}) != 1:
+        raise ValueError("Coverage analysis results in a cohort must contain the same number of amplicons")
+    reads = np.column_stack([table["total_reads"].to_numpy() for table in tables])
+    return tables, reads
+
+
+def cohort_regression(sample_names: List[str], reads: np.ndarray, threshold: int = 0.85, under_ratio: int = 0.5,
+                      over_ratio: int = 1.3) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param sample_names: use sample names in case of low R2 coefficient
+    :param reads: amplicons x samples matrix of the total number of reads
+    :param threshold: Threshold for R2 in linear regression
+    :param under_ratio: The ratio of observed to predicted relative coverage for undercovered amplicons
+    :param over_ratio: The ratio of observed to predicted relative coverage for overcovered amplicons
+    :return: amplicon order, sorted relative coverage, predicted relative coverage, masks of undercovered and
+    overcovered amplicons (all with amplicons x samples shape, in sorted order)
+    """
+    # Count relative number of reads and sort every sample at once:
+    amp_proc = reads / reads.sum(axis=0)
+    order = np.argsort(amp_proc, axis=0)
+    amp_proc_sorted = np.take_along_axis(amp_proc, order, axis=0)
+    serial_num = np.arange(reads.shape[0])
+    slope, intercept, r2 = fit_line(serial_num, amp_proc_sorted)
+    y_predict = intercept + np.multiply.outer(serial_num, slope)
+    for sample_name, score in zip(sample_names, r2):
+        if score < threshold:
+            print(f"R2 for {sample_name} coverage results is less than threshold {threshold}")
+    ratio = np.abs(amp_proc_sorted / y_predict)
+    return order, amp_proc_sorted, y_predict, ratio < under_ratio, ratio > over_ratio
 
 
 def add_prediction(data_sorted: pd.DataFrame, y_predict: np.ndarray, under_ratio: int = 0.5, over_ratio: int = 1.3):
@@ -75,18 +134,19 @@ def amp_scatterplot(sample_name: str, data_sorted: pd.DataFrame, under_amplicons
     :param figure_height: The height of the linear regression plot
     """
     # Save amplicon coverage scatter plot:
-    sns.set_style("darkgrid")
-    sns.set(rc={'figure.figsize': (figure_width, figure_height)})
-    sns.scatterplot(data=data_sorted, x="amp_serial_num", y="amp_proc", color='grey', linewidth=0, size=3)
-    sns.scatterplot(data=under_amplicons, x='amp_serial_num', y='amp_proc', color='red', linewidth=0, size=3)
-    sns.scatterplot(data=over_amplicons, x='amp_serial_num', y='amp_proc', color='green', linewidth=0, size=3)
-    sns.lineplot(data=data_sorted, x="amp_serial_num", y="amp_proc_predict", color="purple")
-    plt.title(f"Profile of amplicon coverage ({sample_name} results)", size=20)
-    plt.xlabel('Amplicon number', size=15)
-    plt.ylabel('Amplicon coverage', size=15)
-    plt.legend([], [], frameon=False)
-    plt.savefig(os.path.join(output_dir, f"{sample_name}_amplicon_coverage_scatterplot.png"))
-    plt.clf()
+    with darkgrid():
+        figure, ax = new_figure(figure_width, figure_height)
+        # Amplicons are sorted by coverage, so evenly spaced points keep the shape of a dense profile:
+        shown = data_sorted.iloc[downsample(data_sorted.shape[0])]
+        for data, color in [(shown, "grey"), (under_amplicons, "red"), (over_amplicons, "green")]:
+            ax.scatter(data["amp_serial_num"], data["amp_proc"], color=color, s=16, linewidths=0, rasterized=True)
+        # The predicted coverage is a straight line:
+        ends = data_sorted.iloc[[0, -1]] if data_sorted.shape[0] else data_sorted
+        ax.plot(ends["amp_serial_num"], ends["amp_proc_predict"], color="purple")
+        ax.set_title(f"Profile of amplicon coverage ({sample_name} results)", size=20)
+        ax.set_xlabel('Amplicon number', size=15)
+        ax.set_ylabel('Amplicon coverage', size=15)
+        figure.savefig(os.path.join(output_dir, f"{sample_name}_amplicon_coverage_scatterplot.png"))
 
 
 def create_output_table(sample_name: str, under_amplicons: pd.DataFrame, over_amplicons: pd.DataFrame,
@@ -107,18 +167,116 @@ def create_output_table(sample_name: str, under_amplicons: pd.DataFrame, over_am
     over_amplicons.to_csv(os.path.join(output_dir, f"{sample_name}_overcovered_amplicons.txt"), sep="\t", index=False)
 
 
-def main(input_files, threshold, under_ratio, over_ratio, output_dir, figure_width, figure_height):
+def read_total_reads(input_file: pathlib.PosixPath) -> np.ndarray:
+    """
+    :param input_file: The path to VariFind or Oncoscope coverage analysis results
+    :return: the total number of reads of each amplicon in the smallest integer type (other columns are not read)
+    """
+    reads = pd.read_csv(input_file, sep="\t", usecols=["total_reads"])["total_reads"]
+    return pd.to_numeric(reads, downcast="integer").to_numpy()
+
+
+def copy_rows(input_file: pathlib.PosixPath, rows: Dict[str, np.ndarray], chunk_size: int = CHUNK_ROWS):
+    """
+    :param input_file: The path to VariFind or Oncoscope coverage analysis results
+    :param rows: The path to an output file -> sorted numbers of rows copied to the file
+    :param chunk_size: The number of rows read at once
+    """
+    header = pd.read_csv(input_file, sep="\t", nrows=0)
+    with ExitStack() as stack:
+        outputs = {output_file: stack.enter_context(open(output_file, "w")) for output_file in rows}
+        for f in outputs.values():
+            header.to_csv(f, sep="\t", index=False)
+        # Values are kept as text to copy them verbatim (create_output_table writes NA as an empty cell, 1.50 as 1.5):
+        reader = stack.enter_context(pd.read_csv(input_file, sep="\t", dtype=str, keep_default_na=False,
+                                                 chunksize=chunk_size))
+        for chunk in reader:
+            for output_file, numbers in rows.items():
+                first, last = np.searchsorted(numbers, [chunk.index[0], chunk.index[-1] + 1])
+                chunk.loc[numbers[first:last]].to_csv(outputs[output_file], sep="\t", header=False, index=False)
+
+
+def sample_name_of(input_file: pathlib.PosixPath) -> str:
+    """
+    :param input_file: The path to VariFind or Oncoscope coverage analysis results
+    :return: an input file name for output file names
+    """
+    return str(input_file).split("/")[-1].split(".tsv")[0]
+
+
+def main_cohort(input_files, threshold, under_ratio, over_ratio, output_dir, figure_width, figure_height,
+                pool: Optional[RenderPool] = None):
+    sample_names = [sample_name_of(el) for el in input_files]
+    tables, reads = cohort_matrix(input_files)
+    order, amp_proc, y_predict, under_mask, over_mask = cohort_regression(sample_names, reads, threshold,
+                                                                         under_ratio, over_ratio)
+    for k, (sample_name, data) in enumerate(zip(sample_names, tables)):
+        table = data.iloc[order[:, k]].assign(amp_proc=amp_proc[:, k], amp_serial_num=np.arange(data.shape[0]),
+                                              amp_proc_predict=y_predict[:, k])
+        table["ratio"] = abs(table["amp_proc"] / table["amp_proc_predict"])
+        under = table.loc[under_mask[:, k]]
+        over = table.loc[over_mask[:, k]]
+        if pool is not None:
+            pool.submit(amp_scatterplot, sample_name, table, under, over, output_dir, figure_width, figure_height)
+        create_output_table(sample_name, under, over, output_dir)
+
+
+def main_samples(input_files, threshold, under_ratio, over_ratio, output_dir, figure_width, figure_height,
+                 pool: Optional[RenderPool] = None):
     for el in input_files:
         # Get an input file name for output file names
-        sample_name = str(el).split("/")[-1].split(".tsv")[0]
+        sample_name = sample_name_of(el)
         table = create_table(el)
         predictions = lin_regression(sample_name, table, threshold)
         table, under, over = add_prediction(table, predictions, under_ratio, over_ratio)
-        amp_scatterplot(sample_name, table, under, over, output_dir, figure_width, figure_height)
+        if pool is not None:
+            pool.submit(amp_scatterplot, sample_name, table, under, over, output_dir, figure_width, figure_height)
         create_output_table(sample_name, under, over, output_dir)
 
 
-if __name__ == "__main__":
+def main_low_memory(input_files, threshold, under_ratio, over_ratio, output_dir, figure_width, figure_height,
+                    pool: Optional[RenderPool] = None, cohort: bool = False):
+    sample_names = [sample_name_of(el) for el in input_files]
+    if cohort:
+        reads = [read_total_reads(input_file) for input_file in input_files]
+        if len({el.shape[0] for el in reads}) != 1:
+            raise ValueError("Coverage analysis results in a cohort must contain the same number of amplicons")
+        groups = [(sample_names, input_files, np.column_stack(reads))]
+    else:
+        groups = (([sample_name], [input_file], read_total_reads(input_file)[:, np.newaxis])
+                  for sample_name, input_file in zip(sample_names, input_files))
+    for names, files, reads in groups:
+        # Only the number of reads is kept in memory, the full rows of flagged amplicons are read again for output:
+        order, amp_proc, y_predict, under_mask, over_mask = cohort_regression(names, reads, threshold, under_ratio,
+                                                                             over_ratio)
+        for k, (sample_name, input_file) in enumerate(zip(names, files)):
+            if pool is not None:
+                table = pd.DataFrame({"amp_proc": amp_proc[:, k], "amp_serial_num": np.arange(reads.shape[0]),
+                                      "amp_proc_predict": y_predict[:, k]})
+                pool.submit(amp_scatterplot, sample_name, table, table.loc[under_mask[:, k]],
+                            table.loc[over_mask[:, k]], output_dir, figure_width, figure_height)
+            # Output tables keep the order of amplicons in the input file:
+            under_rows = np.sort(order[under_mask[:, k], k])
+            over_rows = np.sort(order[over_mask[:, k], k])
+            copy_rows(input_file, {os.path.join(output_dir, f"{sample_name}_undercovered_amplicons.txt"): under_rows,
+                                   os.path.join(output_dir, f"{sample_name}_overcovered_amplicons.txt"): over_rows})
+
+
+@profiled
+def main(input_files, threshold, under_ratio, over_ratio, output_dir, figure_width, figure_height, cohort=False,
+         plots=True, jobs=1, low_memory=False):
+    # Plots are rendered in background processes while the next samples are processed:
+    with RenderPool(jobs if plots else 1) as pool:
+        if low_memory:
+            main_low_memory(input_files, threshold, under_ratio, over_ratio, output_dir, figure_width, figure_height,
+                            pool if plots else None, cohort)
+            return
+        run = main_cohort if cohort else main_samples
+        run(input_files, threshold, under_ratio, over_ratio, output_dir, figure_width, figure_height,
+            pool if plots else None)
+
+
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="Script for searching the undercovered amplicons")
     parser.add_argument("-t", "--threshold", type=float, default=0.85, help="Threshold for R2 in linear regression")
     parser.add_argument("-u", "--under_ratio", type=float, default=0.5,
@@ -133,7 +291,18 @@ if __name__ == "__main__":
                         help="The width of the linear regression plot")
     parser.add_argument("-e", "--figure_height", type=float, default=6,
                         help="The height of the linear regression plot")
-    args = parser.parse_args()
+    parser.add_argument("-c", "--cohort", action="store_true",
+                        help="Process all input files at once as amplicons x samples matrix")
+    parser.add_argument("-n", "--no_plots", action="store_true", help="Skip the scatter plots")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="The number of processes rendering the plots")
+    parser.add_argument("-l", "--low_memory", action="store_true",
+                        help="Read only the number of reads, then copy the rows of flagged amplicons from input files")
+    args = parser.parse_args(argv)
     main(input_files=args.input_files, threshold=args.threshold, under_ratio=args.under_ratio,
          over_ratio=args.over_ratio, output_dir=args.output_dir, figure_width=args.figure_width,
-         figure_height=args.figure_height)
+         figure_height=args.figure_height, cohort=args.cohort, plots=not args.no_plots, jobs=args.jobs,
+         low_memory=args.low_memory)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,294 @@
+import argparse
+import json
+import math
+import os.path
+import pathlib
+import platform
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+import synthetic_data
+
+# Default numbers of rows (amplicons, BED regions, points or table cells) of each stage
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+# The number of annotation columns of coverage analysis results in the amplicon_samples and amplicon_low_memory stages
+ANNOTATIONS = 10
+# Quality thresholds of the sweep in the parse_bed_sweep and surface_plot stages
+SWEEP = list(range(2, 66, 4))
+
+
+def amplicon_table(work_dir: str, rows: int):
+    """
+    :param work_dir: The path to a directory for synthetic input files
+    :param rows: The number of amplicons
+    :return: the path to coverage analysis results and sorted pd.DataFrame
+    """
+    import amplicon_coverage
+    input_file = os.path.join(work_dir, f"coverage_{rows}.tsv")
+    if not os.path.exists(input_file):
+        synthetic_data.coverage_tsv(input_file, rows)
+    return input_file, amplicon_coverage.create_table(input_file)
+
+
+def annotated_coverage(work_dir: str, rows: int) -> str:
+    """
+    :param work_dir: The path to a directory for synthetic input files
+    :param rows: The number of amplicons
+    :return: the path to coverage analysis results with annotation columns
+    """
+    input_file = os.path.join(work_dir, f"coverage_{rows}_annotated.tsv")
+    if not os.path.exists(input_file):
+        synthetic_data.coverage_tsv(input_file, rows, annotations=ANNOTATIONS)
+    return input_file
+
+
+def sequtils_inputs(work_dir: str, rows: int) -> Tuple[str, str]:
+    """
+    :param work_dir: The path to a directory for synthetic input files
+    :param rows: The number of regions
+    :return: the path to a directory with BED file after sequtils and the path to BED file with target regions
+    """
+    input_dir = os.path.join(work_dir, f"sequtils_{rows}")
+    targets_file = os.path.join(work_dir, f"targets_{rows}.bed")
+    if not os.path.exists(input_dir):
+        os.makedirs(input_dir)
+        synthetic_data.sequtils_bed(os.path.join(input_dir, "S_sub0_sequtils.bed"), rows)
+        synthetic_data.target_bed(targets_file, max(rows // 100, 1))
+    return input_dir, targets_file
+
+
+def preload_plotting():
+    """
+    Import matplotlib and seaborn before the measured calls of plotting functions (they are imported lazily)
+    """
+    import matplotlib.backends.backend_agg
+    import seaborn
+
+
+def prepare_create_table(work_dir: str, rows: int) -> Callable:
+    import amplicon_coverage
+    input_file, _ = amplicon_table(work_dir, rows)
+    return lambda: amplicon_coverage.create_table(input_file)
+
+
+def prepare_lin_regression(work_dir: str, rows: int) -> Callable:
+    import amplicon_coverage
+    _, data_sorted = amplicon_table(work_dir, rows)
+    return lambda: amplicon_coverage.lin_regression("benchmark", data_sorted, threshold=0)
+
+
+def prepare_add_prediction(work_dir: str, rows: int) -> Callable:
+    import amplicon_coverage
+    _, data_sorted = amplicon_table(work_dir, rows)
+    y_predict = amplicon_coverage.lin_regression("benchmark", data_sorted, threshold=0)
+    return lambda: amplicon_coverage.add_prediction(data_sorted, y_predict)
+
+
+def prepare_amp_scatterplot(work_dir: str, rows: int) -> Callable:
+    import amplicon_coverage
+    preload_plotting()
+    _, data_sorted = amplicon_table(work_dir, rows)
+    y_predict = amplicon_coverage.lin_regression("benchmark", data_sorted, threshold=0)
+    data_sorted, under, over = amplicon_coverage.add_prediction(data_sorted, y_predict)
+    return lambda: amplicon_coverage.amp_scatterplot("benchmark", data_sorted, under, over, work_dir, 10, 6)
+
+
+def prepare_amplicon_samples(work_dir: str, rows: int) -> Callable:
+    import amplicon_coverage
+    input_file = annotated_coverage(work_dir, rows)
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    return lambda: amplicon_coverage.main_samples([input_file], 0, 0.5, 1.3, output_dir, 10, 6)
+
+
+def prepare_amplicon_low_memory(work_dir: str, rows: int) -> Callable:
+    import amplicon_coverage
+    input_file = annotated_coverage(work_dir, rows)
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    return lambda: amplicon_coverage.main_low_memory([input_file], 0, 0.5, 1.3, output_dir, 10, 6)
+
+
+def prepare_parse_bed(work_dir: str, rows: int, thresholds: Optional[List[int]] = None) -> Callable:
+    import LQR_counting
+    from target_regions import load_targets
+    input_dir, targets_file = sequtils_inputs(work_dir, rows)
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    total_positions = load_targets(targets_file).merged_length
+    return lambda: LQR_counting.parse_bed(16, input_dir, output_dir, total_positions, thresholds=thresholds,
+                                          targets_file=targets_file)
+
+
+def prepare_parse_bed_sweep(work_dir: str, rows: int) -> Callable:
+    return prepare_parse_bed(work_dir, rows, SWEEP)
+
+
+def grid_points(cells: int) -> int:
+    """
+    :param cells: The number of cells of a points x points table
+    :return: the number of points
+    """
+    return max(math.isqrt(cells), 2)
+
+
+def prepare_cov_table(work_dir: str, rows: int) -> Callable:
+    import coverage_table
+    points = grid_points(rows)
+    # The correction coefficient 0 keeps the steps of rows and columns integer:
+    return lambda: coverage_table.cov_table(10, 10 * points, points, 100, 0, work_dir)
+
+
+def prepare_heatmap(work_dir: str, rows: int) -> Callable:
+    import coverage_table
+    import heatmap_coverage
+    preload_plotting()
+    points = grid_points(rows)
+    table = coverage_table.cov_table(10, 10 * points, points, 100, 0, work_dir)
+    return lambda: heatmap_coverage.heatmap(table, work_dir, 15, 6)
+
+
+def prepare_get_params(work_dir: str, rows: int) -> Callable:
+    import subsampling_params
+    return lambda: subsampling_params.get_params(10, 10 + rows - 1, rows, 100, 1_000_000_000, work_dir)
+
+
+def prepare_lqr_plot(work_dir: str, rows: int) -> Callable:
+    import numpy as np
+    import LQR_proportion_plot
+    preload_plotting()
+    proportions = np.linspace(0.5, 0.01, rows).tolist()
+    df = LQR_proportion_plot.proportions_table(10, 10 + rows - 1, rows, proportions)
+    return lambda: LQR_proportion_plot.lqr_plot(df, work_dir, 10, 6)
+
+
+def prepare_surface_plot(work_dir: str, rows: int) -> Callable:
+    import numpy as np
+    import pandas as pd
+    import LQR_proportion_plot
+    preload_plotting()
+    points = max(rows // len(SWEEP), 2)
+    surface = pd.DataFrame(np.linspace(0.5, 0.01, points)[None, :] * np.linspace(0.1, 1, len(SWEEP))[:, None],
+                           index=pd.Index(SWEEP, name="qv"), columns=range(10, 10 + points))
+    return lambda: LQR_proportion_plot.surface_plot(surface, work_dir, 10, 6)
+
+
+# Stage -> function creating the inputs and returning the measured call
+STAGES = {
+    "create_table": prepare_create_table,
+    "lin_regression": prepare_lin_regression,
+    "add_prediction": prepare_add_prediction,
+    "amp_scatterplot": prepare_amp_scatterplot,
+    "amplicon_samples": prepare_amplicon_samples,
+    "amplicon_low_memory": prepare_amplicon_low_memory,
+    "get_params": prepare_get_params,
+    "parse_bed": prepare_parse_bed,
+    "parse_bed_sweep": prepare_parse_bed_sweep,
+    "lqr_plot": prepare_lqr_plot,
+    "surface_plot": prepare_surface_plot,
+    "cov_table": prepare_cov_table,
+    "heatmap": prepare_heatmap,
+}
+
+
+def measure(function: Callable, repeat: int = 1) -> Tuple[float, float]:
+    """
+    :param function: The measured call
+    :param repeat: The number of timed calls
+    :return: the shortest time of a call (s) and the peak memory allocated during a call (MB)
+    """
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+    # Memory is traced in a separate call, tracing slows down allocations:
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak / 1024 ** 2
+
+
+def run_benchmarks(stages: List[str], sizes: List[int], work_dir: str, repeat: int = 1) -> List[Dict]:
+    """
+    :param stages: The names of stages (see STAGES)
+    :param sizes: The numbers of rows
+    :param work_dir: The path to a directory for synthetic input and output files
+    :param repeat: The number of timed calls of each stage
+    :return: the time, peak memory and throughput of each stage for each number of rows
+    """
+    results = []
+    for rows in sizes:
+        for stage in stages:
+            seconds, peak_mb = measure(STAGES[stage](work_dir, rows), repeat)
+            results.append({"stage": stage, "rows": rows, "seconds": round(seconds, 6), "peak_mb": round(peak_mb, 3),
+                            "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None})
+            print(f"{stage:<20}{rows:>12}{seconds:>12.4f} s{peak_mb:>12.1f} MB")
+    return results
+
+
+def compare(baseline: List[Dict], results: List[Dict], tolerance: float) -> List[str]:
+    """
+    :param baseline: Results of a previous run
+    :param results: Results of this run
+    :param tolerance: The maximum allowed ratio of this run's time to the baseline time
+    :return: descriptions of stages slower than the baseline by more than the tolerance
+    """
+    before = {(result["stage"], result["rows"]): result for result in baseline}
+    slower = []
+    for result in results:
+        previous = before.get((result["stage"], result["rows"]))
+        if previous is None or not previous["seconds"]:
+            continue
+        ratio = result["seconds"] / previous["seconds"]
+        print(f'{result["stage"]:<20}{result["rows"]:>12}{previous["seconds"]:>12.4f} s -> {result["seconds"]:.4f} s '
+              f'(x{ratio:.2f}), {previous["peak_mb"]:.1f} MB -> {result["peak_mb"]:.1f} MB')
+        if ratio > tolerance:
+            slower.append(f'{result["stage"]} ({result["rows"]} rows): x{ratio:.2f}')
+    return slower
+
+
+def main(output_file, stages=None, sizes=None, work_dir=None, repeat=1, baseline_file=None, tolerance=None):
+    stages = stages or list(STAGES)
+    sizes = sizes or DEFAULT_SIZES
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = run_benchmarks(stages, sizes, tmp_dir, repeat)
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+        results = run_benchmarks(stages, sizes, str(work_dir), repeat)
+    with open(output_file, "w") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(), "processor_count": os.cpu_count(),
+                   "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": repeat, "results": results}, f, indent=2)
+    if baseline_file is not None:
+        with open(baseline_file, "r") as f:
+            slower = compare(json.load(f)["results"], results, tolerance or math.inf)
+        if slower:
+            raise RuntimeError(f"Stages slower than the baseline: {', '.join(slower)}")
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for benchmarking the pipeline stages on synthetic data")
+    parser.add_argument("-o", "--output_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to output JSON file with the results")
+    parser.add_argument("-t", "--stages", nargs="+", choices=list(STAGES), default=None,
+                        help="The stages to measure (default: all)")
+    parser.add_argument("-n", "--sizes", type=lambda s: [int(float(n)) for n in s.split(",")], default=None,
+                        help="The numbers of rows (amplicons, BED regions, points or table cells), "
+                             "ex. 1000,10000,1e6 (default: 1000,10000,100000)")
+    parser.add_argument("-w", "--work_dir", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to a directory for synthetic files, reused between runs "
+                             "(default: a temporary directory)")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="The number of timed calls of each stage")
+    parser.add_argument("-b", "--baseline_file", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to JSON file with the results of a previous run, for comparison")
+    parser.add_argument("-x", "--tolerance", type=float, default=None,
+                        help="Fail if a stage is slower than the baseline by more than this ratio, ex. 1.2")
+    args = parser.parse_args(argv)
+    main(output_file=args.output_file, stages=args.stages, sizes=args.sizes, work_dir=args.work_dir,
+         repeat=args.repeat, baseline_file=args.baseline_file, tolerance=args.tolerance)
+
+
+if __name__ == "__main__":
+    cli()
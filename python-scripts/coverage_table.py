@@ -3,10 +3,12 @@ import numpy as np
 import pandas as pd
 import pathlib
 import os.path
+from typing import Optional
+from profiling import profiled
 
 
 def cov_table(first_point: int, last_point: int, points: int, amp_number: int, correction: int,
-              output_dir: pathlib.PosixPath):
+              output_dir: pathlib.PosixPath, binary: Optional[str] = None) -> pd.DataFrame:
     """
     :param first_point: The first point among numbers of reads per amplicon
     :param last_point: The last point among numbers of reads per amplicon
@@ -14,6 +16,8 @@ def cov_table(first_point: int, last_point: int, points: int, amp_number: int, c
     :param amp_number: The number of amplicons in a panel
     :param correction: Correction coefficient
     :param output_dir: The path to output files
+    :param binary: The format of an additional binary copy of the table ("npz" or "parquet")
+    :return: pd.DataFrame containing the coverage table
     """
     # Check the first and last points
     if last_point - first_point <= 0:
@@ -31,22 +35,72 @@ def cov_table(first_point: int, last_point: int, points: int, amp_number: int, c
     last_col = int(df.index[-1] * amp_number * (1 + correction/100))
     step = (last_col - first_col) // (points - 1)
     df.columns = range(first_col, last_col + 1, step)
-    # Fill the pd.Dataframe:
-    for i in range(len(df.index)):
-        for j in range(len(df.columns)):
-            if (df.columns[j] / (1 + correction/100)) / (amp_number * df.index[i]) * 100 >= 100:
-                df.iat[i, j] = round(100, 2)
-            else:
-                df.iat[i, j] = round((df.columns[j] / (1 + correction/100)) / (amp_number * df.index[i]) * 100, 2)
+    # Fill the pd.Dataframe (reads per amplicon x reads per sample):
+    reads_per_amp = df.index.to_numpy()[:, np.newaxis]
+    reads_per_sample = df.columns.to_numpy()[np.newaxis, :]
+    coverage = (reads_per_sample / (1 + correction/100)) / (amp_number * reads_per_amp) * 100
+    # np.round differs from Python round() only on values close to halves (e.g. 2.675), round() is applied to them:
+    rounded = np.round(coverage, 2)
+    halves = np.abs((coverage * 100) % 1 - 0.5) < 1e-6
+    rounded[halves] = [round(value, 2) for value in coverage[halves].tolist()]
+    df.iloc[:, :] = np.where(coverage >= 100, 100.0, rounded)
     # Save coverage table:
     df.to_csv(os.path.join(output_dir, "coverage_table.txt"), sep="\t", index=True, header=True)
+    if binary is not None:
+        save_binary_table(df, output_dir, binary)
+    return df
 
 
-def main(first_point, last_point, points, amp_number, correction, output_dir):
-    cov_table(first_point, last_point, points, amp_number, correction, output_dir)
+def require_pyarrow():
+    """
+    Check that pyarrow (an optional dependency for Parquet files) is installed
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet coverage tables require pyarrow (pip install pyarrow), or use the npz format")
 
 
-if __name__ == "__main__":
+def save_binary_table(df: pd.DataFrame, output_dir: pathlib.PosixPath, binary: str):
+    """
+    :param df: pd.DataFrame containing the coverage table
+    :param output_dir: The path to output files
+    :param binary: The format of the binary table ("npz" or "parquet")
+    """
+    if binary == "npz":
+        np.savez(os.path.join(output_dir, "coverage_table.npz"), values=df.to_numpy(),
+                 reads_per_amplicon=df.index.to_numpy(), reads_per_sample=df.columns.to_numpy())
+    elif binary == "parquet":
+        require_pyarrow()
+        # Parquet requires string column names
+        df.set_axis(df.columns.astype(str), axis=1).to_parquet(os.path.join(output_dir, "coverage_table.parquet"))
+    else:
+        raise ValueError(f"Unknown binary format: {binary}")
+
+
+def load_table(input_file: pathlib.PosixPath) -> pd.DataFrame:
+    """
+    :param input_file: The path to a coverage table (TXT, NPZ or Parquet file)
+    :return: pd.DataFrame containing the coverage table
+    """
+    suffix = pathlib.Path(input_file).suffix
+    if suffix == ".npz":
+        with np.load(input_file) as data:
+            return pd.DataFrame(data["values"], index=data["reads_per_amplicon"], columns=data["reads_per_sample"])
+    if suffix == ".parquet":
+        require_pyarrow()
+        df = pd.read_parquet(input_file)
+        df.columns = df.columns.astype(int)
+        return df
+    return pd.read_csv(input_file, sep="\t", header=0, index_col=0)
+
+
+@profiled
+def main(first_point, last_point, points, amp_number, correction, output_dir, binary=None):
+    cov_table(first_point, last_point, points, amp_number, correction, output_dir, binary)
+
+
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="Script for coverage table creation")
     parser.add_argument("-f", "--first_point", type=int, help="The first point among numbers of reads per amplicon")
     parser.add_argument("-l", "--last_point", type=int, help="The last point among numbers of reads per amplicon")
@@ -55,6 +109,12 @@ if __name__ == "__main__":
     parser.add_argument("-c", "--correction", type=int, help="Correction coefficient")
     parser.add_argument("-o", "--output_dir", type=lambda p: pathlib.Path(p).absolute(),
                         help="The path to output files")
-    args = parser.parse_args()
+    parser.add_argument("-b", "--binary", choices=["npz", "parquet"], default=None,
+                        help="Save a binary copy of the table (coverage_table.npz or coverage_table.parquet)")
+    args = parser.parse_args(argv)
     main(first_point=args.first_point, last_point=args.last_point, points=args.points, amp_number=args.amp_number,
-         correction=args.correction, output_dir=args.output_dir)
+         correction=args.correction, output_dir=args.output_dir, binary=args.binary)
+
+
+if __name__ == "__main__":
+    cli()
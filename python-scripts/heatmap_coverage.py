@@ -1,32 +1,38 @@
 import argparse
 import os.path
-import matplotlib.pyplot as plt
 import pandas as pd
 import pathlib
-import seaborn as sns
+from coverage_table import load_table
+from profiling import profiled
+from render import ANNOTATION_LIMIT, new_figure
 
 
-def heatmap(input_file: pathlib.PosixPath, output_dir: pathlib.PosixPath, figure_width: float, figure_height: float):
+def heatmap(df: pd.DataFrame, output_dir: pathlib.PosixPath, figure_width: float, figure_height: float,
+            annotation_limit: int = ANNOTATION_LIMIT):
     """
-    :param input_file: The path to input file
+    :param df: pd.DataFrame containing the coverage table
     :param output_dir: The path to output file directory
     :param figure_width: The width of the heatmap
     :param figure_height: The height of the heatmap
+    :param annotation_limit: The maximum number of cells with annotated values
     """
-    df = pd.read_csv(input_file, sep="\t", header=0, index_col=0)
-    plt.figure(figsize=(figure_width, figure_height))
-    plot = sns.heatmap(df, annot=True, fmt='.3g', cmap="RdYlGn")
+    import seaborn as sns
+    figure, plot = new_figure(figure_width, figure_height)
+    # Annotations of fine grids are unreadable and slow to draw:
+    annot = df.size <= annotation_limit
+    sns.heatmap(df, annot=annot, fmt='.3g', cmap="RdYlGn", rasterized=not annot, ax=plot)
     plot.set_xlabel('Reads per sample', fontsize=15)
     plot.set_ylabel('Reads per amplicon', fontsize=15)
     plot.set_title('Proportion of amplicons (%) with the target coverage', fontsize=15)
-    plt.savefig(os.path.join(output_dir, "heatmap_coverage.png"))
+    figure.savefig(os.path.join(output_dir, "heatmap_coverage.png"))
 
 
-def main(input_file, output_dir, figure_width, figure_height):
-    heatmap(input_file, output_dir, figure_width, figure_height)
+@profiled
+def main(input_file, output_dir, figure_width, figure_height, annotation_limit=ANNOTATION_LIMIT):
+    heatmap(load_table(input_file), output_dir, figure_width, figure_height, annotation_limit)
 
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="Script for coverage heatmap")
     parser.add_argument("-i", "--input_file", type=lambda p: pathlib.Path(p).absolute(),
                         help="The path to input file")
@@ -36,6 +42,12 @@ if __name__ == "__main__":
                         help="The width of the heatmap")
     parser.add_argument("-e", "--figure_height", type=float, default=6,
                         help="The height of the heatmap")
-    args = parser.parse_args()
+    parser.add_argument("-a", "--annotation_limit", type=int, default=ANNOTATION_LIMIT,
+                        help="The maximum number of cells with annotated values")
+    args = parser.parse_args(argv)
     main(input_file=args.input_file, output_dir=args.output_dir, figure_width=args.figure_width,
-         figure_height=args.figure_height)
+         figure_height=args.figure_height, annotation_limit=args.annotation_limit)
+
+
+if __name__ == "__main__":
+    cli()
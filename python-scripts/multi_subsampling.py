@@ -0,0 +1,107 @@
+import argparse
+import hashlib
+import json
+import os.path
+import pathlib
+import pysam
+from typing import List, Optional, Tuple
+from profiling import profiled
+
+
+def read_hash(read_name: str, seed: int = 0) -> float:
+    """
+    :param read_name: The name of a read
+    :param seed: Subsampling seed
+    :return: uniform value in [0, 1), the same for all records of a read (mates, supplementary alignments)
+    """
+    digest = hashlib.blake2b(read_name.encode(), digest_size=8, key=seed.to_bytes(8, "little")).digest()
+    return int.from_bytes(digest, "little") / 2 ** 64
+
+
+def check_mapped_reads(mapped_reads: int, expected: int):
+    """
+    :param mapped_reads: The number of mapped reads counted in the single pass
+    :param expected: The number of mapped reads used for the subsampling parameters (counted by samtools)
+    """
+    if mapped_reads != expected:
+        raise ValueError(f"The BAM file contains {mapped_reads} mapped reads, but the subsampling parameters were "
+                         f"counted for {expected} mapped reads")
+
+
+def output_mode(output_file: str) -> str:
+    """
+    :param output_file: The path to an output alignment file
+    :return: pysam writing mode (SAM for .sam files, otherwise BAM)
+    """
+    return "w" if str(output_file).endswith(".sam") else "wb"
+
+
+def subsample(input_file: pathlib.PosixPath, fractions: List[float], output_files: List[str],
+              seed: int = 0) -> Tuple[int, List[int]]:
+    """
+    :param input_file: The path to an input SAM/BAM file
+    :param fractions: The fractions of reads for each subsample
+    :param output_files: The paths to output files, one for each fraction
+    :param seed: Subsampling seed
+    :return: the number of mapped reads in the input file and the number of records written to each output
+    """
+    if len(fractions) != len(output_files):
+        raise ValueError("The number of fractions is not equal to the number of output files")
+    if not 0 <= seed < 2 ** 64:
+        raise ValueError("The subsampling seed must be a non-negative 64-bit integer")
+    # Route a read to every output with the fraction above its hash value, the largest fractions go first:
+    order = sorted(range(len(fractions)), key=lambda k: fractions[k], reverse=True)
+    mapped_reads = 0
+    written = [0] * len(fractions)
+    with pysam.AlignmentFile(input_file, "r") as alignment:
+        outputs = [pysam.AlignmentFile(out, output_mode(out), template=alignment) for out in output_files]
+        try:
+            for read in alignment:
+                if not read.is_unmapped:
+                    mapped_reads += 1
+                value = read_hash(read.query_name, seed)
+                for k in order:
+                    if fractions[k] <= value:
+                        break
+                    outputs[k].write(read)
+                    written[k] += 1
+        finally:
+            for out in outputs:
+                out.close()
+    return mapped_reads, written
+
+
+@profiled
+def main(input_file, params_file, output_prefix, seed=0, count_file: Optional[pathlib.PosixPath] = None):
+    with open(params_file, "r") as js_data:
+        fractions = list(json.load(js_data).values())
+    output_files = [f"{output_prefix}_sub{index}.bam" for index in range(len(fractions))]
+    mapped_reads, written = subsample(input_file, fractions, output_files, seed)
+    for out, number in zip(output_files, written):
+        print(f"{os.path.basename(out)}: {number} records")
+    # The fractions were counted from the number of mapped reads, so it must be the same in the subsampled file:
+    if count_file is not None:
+        with open(count_file, "r") as f:
+            check_mapped_reads(mapped_reads, int(f.read()))
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for single-pass BAM subsampling to several fractions")
+    parser.add_argument("-i", "--input_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to input SAM/BAM file")
+    parser.add_argument("-p", "--params_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to JSON file with the subsampling parameters")
+    parser.add_argument("-o", "--output_prefix", help="The prefix of output BAM files (<prefix>_sub<index>.bam)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Subsampling seed")
+    parser.add_argument("-c", "--count_file", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to file with the number of mapped reads counted by samtools, "
+                             "checked against the number counted in the single pass")
+    args = parser.parse_args(argv)
+    if not 0 <= args.seed < 2 ** 64:
+        parser.error("the seed must be a non-negative 64-bit integer")
+    main(input_file=args.input_file, params_file=args.params_file, output_prefix=args.output_prefix,
+         seed=args.seed, count_file=args.count_file)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,201 @@
+import argparse
+import importlib
+import os.path
+import pathlib
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+from profiling import profiled
+from render import RenderPool
+from tools import count_mapped_reads, run_sequtils, subsample_bam
+
+# Subcommands: command -> (module, description). A module is imported only when its command is run, so light steps
+# do not load pandas, matplotlib or seaborn.
+COMMANDS = {
+    "amplicon_coverage": ("amplicon_coverage", "Search for under- and overcovered amplicons"),
+    "subsampling_params": ("subsampling_params", "Count the subsampling parameters"),
+    "multi_subsampling": ("multi_subsampling", "Subsample a BAM file to all points in a single pass"),
+    "target_regions": ("target_regions", "Count the number of positions in target regions"),
+    "sequtils_store": ("sequtils_store", "Convert sequtils results into a binary store"),
+    "result_cache": ("result_cache", "Cached per-point runs of samtools and sequtils"),
+    "lqr_counting": ("LQR_counting", "Count LQRs and the proportion of LQRs for each point"),
+    "lqr_model": ("LQR_model", "Model the proportion of LQRs for each point by binomial thinning"),
+    "lqr_plot": ("LQR_proportion_plot", "Plot the proportion of LQRs for each point"),
+    "coverage_table": ("coverage_table", "Create a coverage table"),
+    "heatmap": ("heatmap_coverage", "Create a coverage heatmap"),
+    "performance_report": ("profiling", "Summarize Snakemake benchmark files of a pipeline run"),
+    "synthetic_data": ("synthetic_data", "Generate synthetic input files for benchmarks"),
+    "benchmark": ("benchmark", "Measure the time and peak memory of pipeline stages on synthetic data"),
+}
+
+
+@contextmanager
+def step(message: str) -> Iterator[None]:
+    """
+    :param message: The description of a pipeline step
+    """
+    start_time = time.perf_counter()
+    yield
+    print(f"{message} took {time.perf_counter() - start_time:.2f} s")
+
+
+def run_all(config: dict):
+    """
+    Run all steps of the pipeline in one process, the results of steps are passed to the next steps in memory
+
+    :param config: Pipeline parameters (config_panel_validation.yaml)
+    """
+    os.makedirs(os.path.join(config["run_dir"], "temporal_files"), exist_ok=True)
+    # Plots are rendered in background processes while the next steps run:
+    with RenderPool(int(config["plot_jobs"])) as pool:
+        run_steps(config, pool if config["plots"] else None)
+
+
+def run_steps(config: dict, pool: Optional[RenderPool] = None):
+    """
+    :param config: Pipeline parameters (config_panel_validation.yaml)
+    :param pool: The pool rendering the plots (None - without plots)
+    """
+    run_dir = config["run_dir"]
+    tmp_dir = os.path.join(run_dir, "temporal_files")
+    bam_file = os.path.join(run_dir, f'{config["bam_sample"]}.bam')
+    target_file = os.path.join(run_dir, config["tagret_regions"])
+    sequtils = config["sequtils_command"] or f'java -jar {config["path_to_sequtils"]}'
+    first_point, last_point, points = int(config["first_point"]), int(config["last_point"]), int(config["points"])
+    amp_number = int(config["amp_number"])
+    cache = None
+    if config["result_cache_dir"] and config["single_pass_subsampling"]:
+        raise ValueError("result_cache_dir could not be used with single_pass_subsampling: True")
+    if config["result_cache_dir"]:
+        import result_cache
+        cache = result_cache.ResultCache(config["result_cache_dir"],
+                                         int(float(config["result_cache_max_gb"]) * 1024 ** 3))
+
+    with step("Search for under- and overcovered amplicons"):
+        import amplicon_coverage
+        input_files = [pathlib.Path(run_dir, f"{sample}.tsv") for sample in config["cov_analysis_result"]]
+        if config["amplicon_low_memory"]:
+            amplicon_coverage.main_low_memory(input_files, config["threshold"], config["under_ratio"],
+                                              config["over_ratio"], run_dir, config["lin_reg_width"],
+                                              config["lin_reg_height"], pool, config["amplicon_cohort"])
+        else:
+            run = amplicon_coverage.main_cohort if config["amplicon_cohort"] else amplicon_coverage.main_samples
+            run(input_files, config["threshold"], config["under_ratio"], config["over_ratio"], run_dir,
+                config["lin_reg_width"], config["lin_reg_height"], pool)
+
+    with step("Count the subsampling parameters"):
+        import subsampling_params
+        from target_regions import load_targets
+        if cache is not None:
+            mapped_reads = result_cache.cached_mapped_reads(cache, bam_file, config["samtools"])
+        else:
+            mapped_reads = count_mapped_reads(config["samtools"], bam_file)
+        fractions = list(subsampling_params.get_params(first_point, last_point, points, amp_number, mapped_reads,
+                                                       tmp_dir).values())
+        total_positions = load_targets(target_file).merged_length
+
+    bands = None
+    surface = None
+    if config["lqr_mode"] == "model":
+        with step("Model the proportion of LQRs"):
+            import LQR_model
+            import pandas as pd
+            full_bed = os.path.join(tmp_dir, f'{config["bam_sample"]}_full_sequtils.bed')
+            run_sequtils(sequtils, target_file, bam_file, full_bed)
+            groups, count = LQR_model.coverage_groups(full_bed)
+            expected, band_limits = LQR_model.model_proportions(groups, count, fractions, int(config["qv"]),
+                                                                total_positions, int(config["lqr_model_replicates"]))
+            LQR_model.save_proportions(expected, band_limits, tmp_dir)
+            proportions = expected.tolist()
+            if band_limits is not None:
+                bands = pd.DataFrame(band_limits)
+    else:
+        with step("Subsample the BAM file and run sequtils"):
+            bams = [os.path.join(tmp_dir, f'{config["bam_sample"]}_sub{index}.bam') for index in range(points)]
+            beds = [os.path.join(tmp_dir, f'{config["bam_sample"]}_sub{index}_sequtils.bed') for index in range(points)]
+            if cache is not None:
+                # Only the points missing in the cache are subsampled:
+                tool_version = result_cache.cache_tool_version(cache, config["samtools"], sequtils,
+                                                               config["result_cache_tool_version"] or "")
+                for fraction, bed in zip(fractions, beds):
+                    result_cache.cached_sequtils(cache, bam_file, fraction, int(config["subsampling_seed"]),
+                                                 target_file, bed, config["samtools"], sequtils, tool_version,
+                                                 int(config["subsampling_threads"]))
+            else:
+                if config["single_pass_subsampling"]:
+                    import multi_subsampling
+                    single_pass_reads, _ = multi_subsampling.subsample(bam_file, fractions, bams,
+                                                                       int(config["subsampling_seed"]))
+                    multi_subsampling.check_mapped_reads(single_pass_reads, mapped_reads)
+                for fraction, sub_bam, bed in zip(fractions, bams, beds):
+                    if not config["single_pass_subsampling"]:
+                        subsample_bam(config["samtools"], bam_file, fraction, sub_bam,
+                                      int(config["subsampling_seed"]), int(config["subsampling_threads"]))
+                    run_sequtils(sequtils, target_file, sub_bam, bed)
+                    os.remove(sub_bam)
+        with step("Count LQRs"):
+            import LQR_counting
+            thresholds = LQR_counting.parse_thresholds(str(config["qv_sweep"])) if config["qv_sweep"] else None
+            proportions, surface = LQR_counting.parse_bed(
+                int(config["qv"]), pathlib.Path(tmp_dir), pathlib.Path(tmp_dir), total_positions,
+                params_file=pathlib.Path(tmp_dir, "subsampling_params.json"), jobs=int(config["lqr_jobs"]),
+                store_dir=config["sequtils_store_dir"] or None, thresholds=thresholds,
+                targets_file=pathlib.Path(target_file), cache_dir=config["result_cache_dir"] or None,
+                cache_max_bytes=int(float(config["result_cache_max_gb"]) * 1024 ** 3))
+
+    if pool is not None:
+        import LQR_proportion_plot
+        df = LQR_proportion_plot.proportions_table(first_point, last_point, points, proportions)
+        pool.submit(LQR_proportion_plot.lqr_plot, df, run_dir, config["lqr_plot_width"], config["lqr_plot_height"],
+                    bands)
+        if surface is not None:
+            pool.submit(LQR_proportion_plot.surface_plot, surface, run_dir, config["lqr_plot_width"],
+                        config["lqr_plot_height"], config["qv_surface_style"])
+
+    with step("Create the coverage table"):
+        import coverage_table
+        table = coverage_table.cov_table(first_point, last_point, points, amp_number, int(config["correction_coeff"]),
+                                         run_dir, config["coverage_table_binary"] or None)
+        if pool is not None:
+            import heatmap_coverage
+            pool.submit(heatmap_coverage.heatmap, table, run_dir, config["heatmap_width"], config["heatmap_height"],
+                        int(config["heatmap_annotation_limit"]))
+
+
+def run_all_cli(argv: List[str]):
+    """
+    :param argv: Arguments of the run_all command
+    """
+    parser = argparse.ArgumentParser(prog="panel_validation.py run_all",
+                                     description="Run all steps of the pipeline in one process")
+    parser.add_argument("-c", "--config_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to YAML file with pipeline parameters (config_panel_validation.yaml)")
+    args = parser.parse_args(argv)
+    import yaml
+    with open(args.config_file, "r") as f:
+        config = yaml.safe_load(f)
+    run_all(config)
+
+
+@profiled
+def main(command, argv):
+    if command == "run_all":
+        run_all_cli(argv)
+    else:
+        importlib.import_module(COMMANDS[command][0]).cli(argv)
+
+
+def cli(argv=None):
+    commands = "\n".join(f"  {name:<20}{description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(description="Panel validation pipeline",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=f"commands:\n{commands}\n  {'run_all':<20}Run all steps in one process\n\n"
+                                            f"Run 'panel_validation.py <command> -h' for the arguments of a command")
+    parser.add_argument("command", choices=[*COMMANDS, "run_all"], metavar="command", help="The step to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the command")
+    args = parser.parse_args(argv)
+    main(command=args.command, argv=args.args)
+
+
+if __name__ == "__main__":
+    cli()
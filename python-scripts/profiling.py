@@ -0,0 +1,155 @@
+import argparse
+import functools
+import glob
+import os
+import os.path
+import pathlib
+import sys
+from typing import Callable
+
+# Set this environment variable to a directory to profile main() of the scripts
+PROFILE_ENV = "PANEL_VALIDATION_PROFILE"
+# Columns of Snakemake benchmark files kept in the performance report
+BENCHMARK_COLUMNS = ["s", "cpu_time", "max_rss", "io_in", "io_out"]
+# The number of functions in the text summary of a profile
+TOP_FUNCTIONS = 30
+
+_active = False
+
+
+def profiled(function: Callable) -> Callable:
+    """
+    Run the function under cProfile and tracemalloc if the PANEL_VALIDATION_PROFILE environment variable is set.
+    The profile (<script>_<pid>.prof, readable by pstats or snakeviz) and a text summary with the peak memory
+    (<script>_<pid>.txt) are saved to the directory from the variable.
+
+    :param function: main() of a script
+    :return: the function with the profiling hook
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global _active
+        profile_dir = os.environ.get(PROFILE_ENV)
+        # Profilers do not nest, so main() of a subcommand run by panel_validation.py is not profiled again:
+        if not profile_dir or _active:
+            return function(*args, **kwargs)
+        import cProfile
+        import tracemalloc
+        module = function.__module__
+        if module == "__main__":
+            module = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        name = os.path.join(profile_dir, f"{module}_{os.getpid()}")
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler = cProfile.Profile()
+        _active = True
+        tracemalloc.start()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _active = False
+            save_profile(profiler, peak, name)
+    return wrapper
+
+
+def save_profile(profiler, peak: int, name: str):
+    """
+    :param profiler: cProfile.Profile after the run
+    :param peak: The peak memory traced by tracemalloc (bytes)
+    :param name: The path to output files without extension
+    """
+    import pstats
+    profiler.dump_stats(f"{name}.prof")
+    with open(f"{name}.txt", "w") as f:
+        f.write(f"Command: {' '.join(sys.argv)}\n")
+        f.write(f"Peak traced memory: {peak / 1024 ** 2:.1f} MB\n\n")
+        pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+
+def read_benchmarks(benchmark_dir: pathlib.PosixPath):
+    """
+    :param benchmark_dir: The path to the directory with Snakemake benchmark files (<rule>[.<wildcards>].tsv)
+    :return: pd.DataFrame with the job, rule, wall time, CPU time, peak RSS and I/O of each job
+    """
+    import pandas as pd
+    jobs = []
+    for benchmark_file in sorted(glob.glob(os.path.join(benchmark_dir, "*.tsv"))):
+        job = os.path.splitext(os.path.basename(benchmark_file))[0]
+        df = pd.read_csv(benchmark_file, sep="\t")
+        # Snakemake writes "-" for values it could not measure
+        values = df.reindex(columns=BENCHMARK_COLUMNS).apply(pd.to_numeric, errors="coerce").mean()
+        jobs.append({"job": job, "rule": job.split(".")[0], **values.to_dict()})
+    return pd.DataFrame(jobs, columns=["job", "rule", *BENCHMARK_COLUMNS])
+
+
+def performance_report(benchmark_dir: pathlib.PosixPath, output_dir: pathlib.PosixPath, plot: bool = True,
+                       figure_width: float = 10, figure_height: float = 6):
+    """
+    :param benchmark_dir: The path to the directory with Snakemake benchmark files
+    :param output_dir: The path to output files
+    :param plot: Create the summary plot
+    :param figure_width: The width of the plot
+    :param figure_height: The height of the plot
+    :return: pd.DataFrame with the total wall time, CPU time, I/O and maximum peak RSS of each rule
+    """
+    jobs = read_benchmarks(benchmark_dir)
+    report = jobs.groupby("rule", sort=False).agg(
+        jobs=("job", "size"), wall_time_s=("s", "sum"), cpu_time_s=("cpu_time", "sum"),
+        max_rss_mb=("max_rss", "max"), io_in_mb=("io_in", "sum"), io_out_mb=("io_out", "sum"))
+    report = report.sort_values("wall_time_s", ascending=False)
+    report["wall_time_share"] = report["wall_time_s"] / report["wall_time_s"].sum()
+    report.to_csv(os.path.join(output_dir, "performance_report.txt"), sep="\t", float_format="%.3f")
+    jobs.to_csv(os.path.join(output_dir, "performance_jobs.txt"), sep="\t", index=False, float_format="%.3f")
+    if plot:
+        report_plot(report, output_dir, figure_width, figure_height)
+    return report
+
+
+def report_plot(report, output_dir: pathlib.PosixPath, figure_width: float, figure_height: float):
+    """
+    :param report: pd.DataFrame with the total wall time, CPU time and maximum peak RSS of each rule
+    :param output_dir: The path to an output file directory
+    :param figure_width: The width of the plot
+    :param figure_height: The height of the plot
+    """
+    import numpy as np
+    from render import darkgrid, new_figure
+    with darkgrid():
+        figure, plot = new_figure(figure_width, figure_height)
+        rules = np.arange(report.shape[0])
+        plot.barh(rules + 0.2, report["wall_time_s"], height=0.4, color="purple", label="Wall time")
+        plot.barh(rules - 0.2, report["cpu_time_s"].fillna(0), height=0.4, color="grey", label="CPU time")
+        labels = [f"{rule} ({rss:.0f} MB)" if rss == rss else rule
+                  for rule, rss in zip(report.index, report["max_rss_mb"])]
+        plot.set_yticks(rules)
+        plot.set_yticklabels(labels)
+        plot.invert_yaxis()
+        plot.legend(loc="lower right")
+        plot.set_title("Time of pipeline steps (peak RSS)", fontsize=20)
+        plot.set_xlabel("Seconds (total for all jobs of a step)", fontsize=15)
+        figure.tight_layout()
+        figure.savefig(os.path.join(output_dir, "performance_report.png"))
+
+
+def main(benchmark_dir, output_dir, plot=True, figure_width=10, figure_height=6):
+    report = performance_report(benchmark_dir, output_dir, plot, figure_width, figure_height)
+    print(report.to_string(float_format=lambda value: f"{value:.2f}"))
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for the performance report of a pipeline run")
+    parser.add_argument("-i", "--benchmark_dir", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to the directory with Snakemake benchmark files")
+    parser.add_argument("-o", "--output_dir", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to output files")
+    parser.add_argument("-n", "--no_plot", action="store_true", help="Do not create the summary plot")
+    parser.add_argument("-w", "--figure_width", type=float, default=10, help="The width of the plot")
+    parser.add_argument("-e", "--figure_height", type=float, default=6, help="The height of the plot")
+    args = parser.parse_args(argv)
+    main(benchmark_dir=args.benchmark_dir, output_dir=args.output_dir, plot=not args.no_plot,
+         figure_width=args.figure_width, figure_height=args.figure_height)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+# Heatmaps with more cells are drawn without per-cell annotations
+ANNOTATION_LIMIT = 400
+# Point clouds with more points are downsampled before plotting
+MAX_POINTS = 20_000
+# seaborn "darkgrid" style, set with matplotlib only (importing seaborn takes seconds)
+DARKGRID = {
+    "axes.facecolor": "#EAEAF2", "axes.edgecolor": "white", "axes.grid": True, "axes.axisbelow": True,
+    "axes.labelcolor": ".15", "grid.color": "white", "text.color": ".15", "xtick.color": ".15", "ytick.color": ".15",
+    "xtick.bottom": False, "ytick.left": False, "lines.solid_capstyle": "round", "font.size": 12,
+    "axes.labelsize": 12, "axes.titlesize": 12, "xtick.labelsize": 11, "ytick.labelsize": 11, "legend.fontsize": 11,
+}
+
+
+def new_figure(figure_width: float, figure_height: float):
+    """
+    :param figure_width: The width of the figure
+    :param figure_height: The height of the figure
+    :return: matplotlib Figure with the Agg canvas and its axes (not registered in pyplot, so it is freed after use)
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(figure_width, figure_height))
+    FigureCanvasAgg(figure)
+    return figure, figure.add_subplot()
+
+
+@contextmanager
+def darkgrid() -> Iterator[None]:
+    """
+    Apply the "darkgrid" style to figures created and saved inside the context
+    """
+    import matplotlib
+    with matplotlib.rc_context(DARKGRID):
+        yield
+
+
+def downsample(points: int, max_points: int = MAX_POINTS):
+    """
+    :param points: The number of points (sorted along the x axis)
+    :param max_points: The maximum number of points to draw
+    :return: indices of evenly spaced points, including the first and the last point
+    """
+    import numpy as np
+    if points <= max_points:
+        return np.arange(points)
+    return np.unique(np.linspace(0, points - 1, max_points).round().astype(np.int64))
+
+
+class RenderPool:
+    """
+    Render plots in background worker processes, or at once if jobs <= 1
+    """
+
+    def __init__(self, jobs: int = 1):
+        self.executor = None
+        self.futures = []
+        if jobs > 1:
+            # Workers inherit matplotlib imported before they start
+            import matplotlib.backends.backend_agg
+            self.executor = ProcessPoolExecutor(max_workers=jobs)
+
+    def submit(self, function: Callable, *args):
+        """
+        :param function: The plotting function
+        :param args: Arguments of the function (sent to a worker process)
+        """
+        if self.executor is None:
+            function(*args)
+        else:
+            self.futures.append(self.executor.submit(function, *args))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            # Raise errors of plotting functions:
+            for future in self.futures:
+                future.result()
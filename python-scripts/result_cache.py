@@ -0,0 +1,215 @@
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import shlex
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from profiling import profiled
+from sequtils_store import file_digest
+from tools import command_version, count_mapped_reads, run_sequtils, subsample_bam, tool_versions
+
+# Version of cached results, change it if the format of cached files changes
+CACHE_VERSION = 1
+# Default size limit of the cache: 20 GB
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+
+def cache_key(**fields) -> str:
+    """
+    :param fields: Everything the cached result depends on (checksums of inputs, parameters, tool versions)
+    :return: SHA-256 of the fields
+    """
+    fields["cache_version"] = CACHE_VERSION
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+@dataclass
+class ResultCache:
+    cache_dir: str
+    max_bytes: int = DEFAULT_MAX_BYTES
+
+    @property
+    def entries_dir(self) -> str:
+        return os.path.join(self.cache_dir, "entries")
+
+    def restore(self, key: str, outputs: Dict[str, str]) -> Optional[dict]:
+        """
+        :param key: The key of a cache entry
+        :param outputs: Cached file name -> the path to copy the file to
+        :return: metadata of the entry, or None if the entry is not in the cache
+        """
+        entry = os.path.join(self.entries_dir, key)
+        meta_file = os.path.join(entry, "meta.json")
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            for name, output_file in outputs.items():
+                shutil.copyfile(os.path.join(entry, name), output_file)
+            # The modification time of metadata is the last use of the entry:
+            os.utime(meta_file)
+        except FileNotFoundError:
+            # Not cached yet or evicted by another process
+            return None
+        return meta
+
+    def store(self, key: str, files: Dict[str, str], meta: Optional[dict] = None):
+        """
+        :param key: The key of a cache entry
+        :param files: Cached file name -> the path to the file
+        :param meta: JSON-serializable metadata (e.g. counts) saved with the files
+        """
+        os.makedirs(self.entries_dir, exist_ok=True)
+        entry = os.path.join(self.entries_dir, key)
+        tmp_entry = tempfile.mkdtemp(prefix=f"{key}.tmp-", dir=self.entries_dir)
+        size = 0
+        for name, input_file in files.items():
+            shutil.copyfile(input_file, os.path.join(tmp_entry, name))
+            size += os.path.getsize(input_file)
+        with open(os.path.join(tmp_entry, "meta.json"), "w") as f:
+            json.dump({**(meta or {}), "size": size, "stored": time.time()}, f)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # The same result has been stored by another process
+            shutil.rmtree(tmp_entry)
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        Delete the least recently used entries while the cache is larger than max_bytes
+
+        :param keep: The key of an entry that is never deleted (the entry just stored)
+        """
+        entries = []
+        for key in os.listdir(self.entries_dir):
+            meta_file = os.path.join(self.entries_dir, key, "meta.json")
+            if ".tmp-" in key:
+                continue
+            # The entry could be incomplete or deleted by another process
+            try:
+                with open(meta_file, "r") as f:
+                    size = json.load(f)["size"]
+                entries.append((os.path.getmtime(meta_file), key, size))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.entries_dir, key), ignore_errors=True)
+            total -= size
+
+
+def cache_tool_version(cache: ResultCache, samtools: str, sequtils: str, label: str = "") -> str:
+    """
+    :param cache: Result cache (checksums of input files are remembered in it)
+    :param samtools: The command for samtools
+    :param sequtils: The command for sequtils
+    :param label: Version of sequtils or any label set by the user
+    :return: samtools version, the sequtils command and its version (SHA-256 of the jar file for "java -jar <jar>"
+    commands, otherwise the '<sequtils> --version' output) and the label, a part of the key
+    """
+    args = shlex.split(sequtils)
+    if "-jar" in args[:-1]:
+        sequtils_version = f'sha256:{file_digest(args[args.index("-jar") + 1], cache.cache_dir)}'
+    else:
+        sequtils_version = command_version(sequtils)
+    return f"{tool_versions(samtools, sequtils)}; {sequtils_version}; {label}"
+
+
+def cached_mapped_reads(cache: ResultCache, bam_file: str, samtools: str) -> int:
+    """
+    :param cache: Result cache
+    :param bam_file: The path to a BAM file
+    :param samtools: The command for samtools
+    :return: the number of mapped reads (counted by samtools on a cache miss)
+    """
+    key = cache_key(kind="mapped_reads", bam=file_digest(bam_file, cache.cache_dir))
+    meta = cache.restore(key, {})
+    if meta is not None:
+        return meta["mapped_reads"]
+    mapped_reads = count_mapped_reads(samtools, bam_file)
+    cache.store(key, {}, {"mapped_reads": mapped_reads})
+    return mapped_reads
+
+
+def cached_sequtils(cache: ResultCache, bam_file: str, fraction: float, seed: int, target_file: str, output_file: str,
+                    samtools: str, sequtils: str, tool_version: str = "", threads: int = 1) -> bool:
+    """
+    :param cache: Result cache
+    :param bam_file: The path to a BAM file
+    :param fraction: The fraction of reads of the point
+    :param seed: Subsampling seed
+    :param target_file: The path to BED file with target regions
+    :param output_file: The path to an output BED file after sequtils
+    :param samtools: The command for samtools
+    :param sequtils: The command for sequtils
+    :param tool_version: Versions of samtools and sequtils, a part of the key
+    :param threads: The number of samtools threads
+    :return: True if the result has been taken from the cache
+    """
+    key = cache_key(kind="sequtils", bam=file_digest(bam_file, cache.cache_dir), fraction=fraction, seed=seed,
+                    targets=file_digest(target_file, cache.cache_dir), tool_version=tool_version)
+    if cache.restore(key, {"sequtils.bed": output_file}) is not None:
+        return True
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as tmp_dir:
+        sub_bam = os.path.join(tmp_dir, "sub.bam")
+        subsample_bam(samtools, bam_file, fraction, sub_bam, seed, threads)
+        run_sequtils(sequtils, target_file, sub_bam, output_file)
+    cache.store(key, {"sequtils.bed": output_file}, {"fraction": fraction, "bam": os.path.basename(bam_file)})
+    return False
+
+
+@profiled
+def main(command, bam_file, cache_dir, output_file, max_gb=20, samtools="samtools", sequtils=None, target_file=None,
+         params_file=None, index=0, seed=0, tool_version="", threads=1):
+    cache = ResultCache(str(cache_dir), int(max_gb * 1024 ** 3))
+    if command == "mapped_reads":
+        with open(output_file, "w") as f:
+            f.write(f"{cached_mapped_reads(cache, bam_file, samtools)}\n")
+        return
+    with open(params_file, "r") as js_data:
+        fraction = list(json.load(js_data).values())[index]
+    tool_version = cache_tool_version(cache, samtools, sequtils, tool_version)
+    hit = cached_sequtils(cache, bam_file, fraction, seed, target_file, output_file, samtools, sequtils,
+                          tool_version, threads)
+    print(f"Point {index} (fraction {fraction}): {'taken from the cache' if hit else 'computed'}")
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for cached per-point runs of samtools and sequtils")
+    parser.add_argument("command", choices=["mapped_reads", "sequtils"],
+                        help="Count mapped reads or subsample and run sequtils for one point")
+    parser.add_argument("-i", "--bam_file", type=lambda p: pathlib.Path(p).absolute(), help="The path to BAM file")
+    parser.add_argument("-d", "--cache_dir", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to the cache directory")
+    parser.add_argument("-o", "--output_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to output file (the number of mapped reads or BED file after sequtils)")
+    parser.add_argument("-m", "--max_gb", type=float, default=20, help="The size limit of the cache in GB")
+    parser.add_argument("--samtools", default="samtools", help="The command for samtools")
+    parser.add_argument("--sequtils", default=None, help="The command for sequtils")
+    parser.add_argument("-r", "--target_file", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to BED file with target regions")
+    parser.add_argument("-p", "--params_file", type=lambda p: pathlib.Path(p).absolute(), default=None,
+                        help="The path to JSON file with the subsampling parameters")
+    parser.add_argument("-x", "--index", type=int, default=0, help="The index of the point")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Subsampling seed")
+    parser.add_argument("-v", "--tool_version", default="",
+                        help="Version of sequtils or other tools, added to the cache key (change it to invalidate)")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="The number of samtools threads")
+    args = parser.parse_args(argv)
+    main(command=args.command, bam_file=args.bam_file, cache_dir=args.cache_dir, output_file=args.output_file,
+         max_gb=args.max_gb, samtools=args.samtools, sequtils=args.sequtils, target_file=args.target_file,
+         params_file=args.params_file, index=args.index, seed=args.seed, tool_version=args.tool_version,
+         threads=args.threads)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from profiling import profiled
+
+# Columns of 'sequtils regions' output used for LQR counting: contig, start, stop, forward and reverse coverage
+SEQUTILS_COLUMNS = {0: "contig", 1: "start", 2: "stop", 4: "fwd_cov", 5: "rev_cov"}
+# Per-position columns of the store, all saved as int32 arrays
+STORE_COLUMNS = ["contig", "start", "stop", "fwd_cov", "rev_cov"]
+
+
+def read_sequtils(input_file: pathlib.PosixPath, chunk_size: int = 1_000_000) -> Iterator[pd.DataFrame]:
+    """
+    :param input_file: The path to a BED file after sequtils
+    :param chunk_size: The number of rows read at once
+    :return: iterator over pd.DataFrame chunks with contig, start, stop, fwd_cov and rev_cov columns
+    """
+    # Coverage columns are kept as text to write them into the LQR file unchanged
+    dtypes = {0: str, 1: np.int64, 2: np.int64, 4: str, 5: str}
+    try:
+        reader = pd.read_csv(input_file, sep=r"\s+", header=None, usecols=list(SEQUTILS_COLUMNS), dtype=dtypes,
+                             keep_default_na=False, chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        return
+    with reader:
+        for chunk in reader:
+            yield chunk.rename(columns=SEQUTILS_COLUMNS)
+
+
+@dataclass
+class SequtilsStore:
+    contigs: List[str]
+    contig: np.ndarray
+    start: np.ndarray
+    stop: np.ndarray
+    fwd_cov: np.ndarray
+    rev_cov: np.ndarray
+
+    @property
+    def rows(self) -> int:
+        return self.contig.shape[0]
+
+    def frame(self, rows: slice, mask: np.ndarray) -> pd.DataFrame:
+        """
+        :param rows: The slice of store rows
+        :param mask: boolean np.array selecting rows of the slice
+        :return: pd.DataFrame with contig, start, stop, fwd_cov and rev_cov columns of selected rows
+        """
+        return pd.DataFrame({
+            "contig": pd.Categorical.from_codes(self.contig[rows][mask], self.contigs),
+            "start": self.start[rows][mask].astype(np.int64),
+            "stop": self.stop[rows][mask].astype(np.int64),
+            "fwd_cov": self.fwd_cov[rows][mask],
+            "rev_cov": self.rev_cov[rows][mask],
+        })
+
+    def chunks(self, chunk_size: int = 1_000_000) -> Iterator[slice]:
+        """
+        :param chunk_size: The number of rows in a slice
+        :return: iterator over slices of store rows
+        """
+        for begin in range(0, self.rows, chunk_size):
+            yield slice(begin, min(begin + chunk_size, self.rows))
+
+
+def file_digest(input_file: pathlib.PosixPath, store_dir: pathlib.PosixPath) -> str:
+    """
+    :param input_file: The path to a BED file after sequtils
+    :param store_dir: The path to the store directory
+    :return: SHA-256 of the file content (cached by path, size and modification time)
+    """
+    stat = os.stat(input_file)
+    source = os.path.abspath(input_file)
+    index_file = os.path.join(store_dir, "sources", hashlib.sha1(source.encode()).hexdigest() + ".json")
+    if os.path.exists(index_file):
+        with open(index_file, "r") as f:
+            cached = json.load(f)
+        if cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["digest"]
+    sha = hashlib.sha256()
+    with open(input_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    tmp_file = f"{index_file}.{os.getpid()}"
+    with open(tmp_file, "w") as f:
+        json.dump({"source": source, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest}, f)
+    os.replace(tmp_file, index_file)
+    return digest
+
+
+def to_int32(values: pd.Series, name: str) -> np.ndarray:
+    """
+    :param values: Column of a sequtils BED file
+    :param name: The name of the column for error messages
+    :return: the column as int32 np.array
+    """
+    numbers = pd.to_numeric(values).to_numpy()
+    converted = numbers.astype(np.int32)
+    if not np.array_equal(converted, numbers):
+        raise ValueError(f"Column {name} contains values that could not be stored as int32")
+    # Coverage is written into the LQR file as text, so it has to be restored exactly (e.g. not "12.0" or "012")
+    text = not pd.api.types.is_numeric_dtype(values)
+    if text and not np.array_equal(converted.astype(str), values.to_numpy(dtype=str)):
+        raise ValueError(f"Column {name} contains values that could not be restored from int32 unchanged")
+    return converted
+
+
+def convert(input_file: pathlib.PosixPath, store_dir: pathlib.PosixPath, chunk_size: int = 1_000_000) -> str:
+    """
+    :param input_file: The path to a BED file after sequtils
+    :param store_dir: The path to the store directory
+    :param chunk_size: The number of rows processed at once
+    :return: the path to the store entry of the file or None if the file could not be stored without changes
+    """
+    entry = os.path.join(store_dir, file_digest(input_file, store_dir))
+    if os.path.exists(os.path.join(entry, "meta.json")):
+        return entry
+    # Files with non-integer coverage are read as text, the reason is saved to skip the conversion next time
+    unsupported_file = f"{entry}.unsupported"
+    if os.path.exists(unsupported_file):
+        return None
+    tmp_entry = f"{entry}.tmp-{os.getpid()}"
+    os.makedirs(tmp_entry, exist_ok=True)
+    contigs = {}
+    rows = 0
+    files = {column: open(os.path.join(tmp_entry, f"{column}.int32"), "wb") for column in STORE_COLUMNS}
+    try:
+        for chunk in read_sequtils(input_file, chunk_size):
+            # Contig dictionary: contig name -> code
+            names = chunk["contig"].to_numpy()
+            for name in pd.unique(names):
+                contigs.setdefault(name, len(contigs))
+            codes = pd.Series(names).map(contigs).to_numpy(dtype=np.int32)
+            files["contig"].write(codes.tobytes())
+            for column in STORE_COLUMNS[1:]:
+                files[column].write(to_int32(chunk[column], column).tobytes())
+            rows += chunk.shape[0]
+    except ValueError as error:
+        for f in files.values():
+            f.close()
+        shutil.rmtree(tmp_entry)
+        with open(unsupported_file, "w") as f:
+            f.write(f"{os.path.basename(input_file)}: {error}\n")
+        return None
+    finally:
+        for f in files.values():
+            f.close()
+    with open(os.path.join(tmp_entry, "meta.json"), "w") as f:
+        json.dump({"source": os.path.basename(input_file), "rows": rows, "contigs": list(contigs)}, f)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # The same content has been stored by another process
+        shutil.rmtree(tmp_entry)
+    return entry
+
+
+def load(entry: str) -> SequtilsStore:
+    """
+    :param entry: The path to a store entry
+    :return: SequtilsStore with memory-mapped arrays
+    """
+    with open(os.path.join(entry, "meta.json"), "r") as f:
+        meta = json.load(f)
+    arrays = {}
+    for column in STORE_COLUMNS:
+        if meta["rows"] == 0:
+            arrays[column] = np.zeros(0, dtype=np.int32)
+        else:
+            arrays[column] = np.memmap(os.path.join(entry, f"{column}.int32"), dtype=np.int32, mode="r",
+                                       shape=(meta["rows"],))
+    return SequtilsStore(contigs=meta["contigs"], **arrays)
+
+
+def store_chunks(input_file: pathlib.PosixPath, store_dir: pathlib.PosixPath, chunk_size: int = 1_000_000
+                 ) -> Optional[Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, Callable]]]:
+    """
+    :param input_file: The path to a BED file after sequtils
+    :param store_dir: The path to the store directory
+    :param chunk_size: The number of rows processed at once
+    :return: iterator over forward coverage, reverse coverage, length of regions and a function selecting rows of
+    a chunk, or None if the file could not be stored (it has to be read as text)
+    """
+    entry = convert(input_file, store_dir, chunk_size)
+    if entry is None:
+        return None
+    store = load(entry)
+    return ((store.fwd_cov[rows], store.rev_cov[rows], store.stop[rows].astype(np.int64) + 1 - store.start[rows],
+             lambda mask, rows=rows: store.frame(rows, mask)) for rows in store.chunks(chunk_size))
+
+
+@profiled
+def main(input_files, store_dir, chunk_size=1_000_000):
+    for el in input_files:
+        entry = convert(el, store_dir, chunk_size)
+        print(f"{os.path.basename(el)}: {entry if entry else 'not stored, non-integer coverage is read as text'}")
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for converting sequtils BED files into a binary store")
+    parser.add_argument("-i", "--input_files", nargs="+", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to BED files after sequtils")
+    parser.add_argument("-s", "--store_dir", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to the store directory")
+    parser.add_argument("-c", "--chunk_size", type=int, default=1_000_000,
+                        help="The number of BED rows processed at once")
+    args = parser.parse_args(argv)
+    main(input_files=args.input_files, store_dir=args.store_dir, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    cli()
@@ -2,10 +2,11 @@ import argparse
 import json
 import pathlib
 import os.path
+from profiling import profiled
 
 
 def get_params(first_point: int, last_point: int, points: int, amp_number: int, mapped_reads: int,
-               output_dir: pathlib.PosixPath):
+               output_dir: pathlib.PosixPath) -> dict:
     """
     :param first_point: The first point among numbers of reads per amplicon
     :param last_point: The last point among numbers of reads per amplicon
@@ -13,6 +14,7 @@ def get_params(first_point: int, last_point: int, points: int, amp_number: int,
     :param amp_number: The number of amplicons in a panel
     :param mapped_reads: The number of mapped reads in a BAM file
     :param output_dir: The path to output files
+    :return: dictionary with the fraction of reads for each number of reads per amplicon
     """
     # Check the first and last points
     if last_point - first_point <= 0:
@@ -32,13 +34,15 @@ def get_params(first_point: int, last_point: int, points: int, amp_number: int,
     # Make a .json file with parameters for a subsequent subsampling
     with open(os.path.join(output_dir, "subsampling_params.json"), 'w') as f:
         json.dump(amplicon_dict, f)
+    return amplicon_dict
 
 
+@profiled
 def main(first_point, last_point, points, amp_number, mapped_reads, output_dir):
     get_params(first_point, last_point, points, amp_number, mapped_reads, output_dir)
 
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="Script for subsampling parameters")
     parser.add_argument("-f", "--first_point", type=int, help="The first point among numbers of reads per amplicon")
     parser.add_argument("-l", "--last_point", type=int, help="The last point among numbers of reads per amplicon")
@@ -47,6 +51,10 @@ if __name__ == "__main__":
     parser.add_argument("-m", "--mapped_reads", type=int, help="The number of mapped reads in a .bam file")
     parser.add_argument("-o", "--output_dir", type=lambda p: pathlib.Path(p).absolute(),
                         help="The path to output files")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     main(first_point=args.first_point, last_point=args.last_point, points=args.points, amp_number=args.amp_number,
          mapped_reads=args.mapped_reads, output_dir=args.output_dir)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,97 @@
+import argparse
+import pathlib
+import numpy as np
+import pandas as pd
+
+# Synthetic regions are spread over these contigs
+CONTIGS = [f"chr{n}" for n in range(1, 23)]
+# The number of rows generated and written at once
+CHUNK_ROWS = 1_000_000
+
+
+def coverage_tsv(output_file: pathlib.PosixPath, amplicons: int, seed: int = 0, annotations: int = 0) -> pd.DataFrame:
+    """
+    :param output_file: The path to an output TSV file in the format of coverage analysis results
+    :param amplicons: The number of amplicons
+    :param seed: Random seed
+    :param annotations: The number of additional text annotation columns
+    :return: pd.DataFrame with the amplicon name, contig, total number of reads and annotations
+    """
+    rng = np.random.default_rng(seed)
+    # Amplicon coverage is close to log-normal, with a few dropouts:
+    reads = np.round(rng.lognormal(mean=6, sigma=0.6, size=amplicons)).astype(np.int64)
+    reads[rng.random(amplicons) < 0.01] //= 20
+    df = pd.DataFrame({"amplicon": [f"AMP{n}" for n in range(amplicons)],
+                       "chrom": np.array(CONTIGS)[rng.integers(0, len(CONTIGS), amplicons)],
+                       "total_reads": reads})
+    for n in range(annotations):
+        df[f"annotation{n}"] = [f"gene{k % 20000};exon{k % 30};note{n}" for k in range(amplicons)]
+    df.to_csv(output_file, sep="\t", index=False)
+    return df
+
+
+def target_bed(output_file: pathlib.PosixPath, regions: int, seed: int = 0):
+    """
+    :param output_file: The path to an output BED file with target regions
+    :param regions: The number of target regions
+    :param seed: Random seed
+    """
+    rng = np.random.default_rng(seed)
+    per_contig = np.bincount(np.arange(regions) % len(CONTIGS), minlength=len(CONTIGS))
+    with open(output_file, "w") as f:
+        for contig, number in zip(CONTIGS, per_contig):
+            # Amplicons of 100-300 bp, about a tenth of them overlap the previous one:
+            length = rng.integers(100, 301, number)
+            gap = np.where(rng.random(number) < 0.1, -50, rng.integers(50, 500, number))
+            step = length + gap
+            start = 1000 + np.cumsum(step) - step
+            pd.DataFrame({"contig": contig, "start": start, "end": start + length}).to_csv(
+                f, sep="\t", index=False, header=False)
+
+
+def sequtils_bed(output_file: pathlib.PosixPath, rows: int, seed: int = 0):
+    """
+    :param output_file: The path to an output BED file in the format of 'sequtils regions' results
+    :param rows: The number of regions
+    :param seed: Random seed
+    """
+    rng = np.random.default_rng(seed)
+    per_contig = -(-rows // len(CONTIGS))
+    with open(output_file, "w") as f:
+        for first in range(0, rows, CHUNK_ROWS):
+            number = min(CHUNK_ROWS, rows - first)
+            index = np.arange(first, first + number)
+            contig = np.array(CONTIGS)[index // per_contig]
+            # Adjacent regions of 1-20 bp, the stop position is inclusive:
+            length = rng.integers(1, 21, number)
+            start = 1000 + (index % per_contig) * 21
+            coverage = rng.lognormal(mean=3, sigma=1, size=number)
+            pd.DataFrame({"contig": contig, "start": start, "stop": start + length - 1, "name": "x",
+                          "fwd_cov": rng.poisson(coverage), "rev_cov": rng.poisson(coverage)}).to_csv(
+                f, sep="\t", index=False, header=False)
+
+
+def main(kind, rows, output_file, seed=0, annotations=0):
+    if kind == "coverage":
+        coverage_tsv(output_file, rows, seed, annotations)
+    else:
+        generators = {"targets": target_bed, "sequtils": sequtils_bed}
+        generators[kind](output_file, rows, seed)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for generating synthetic input files for benchmarks")
+    parser.add_argument("-k", "--kind", choices=["coverage", "targets", "sequtils"],
+                        help="Coverage analysis TSV file, BED file with target regions or BED file after sequtils")
+    parser.add_argument("-n", "--rows", type=int, help="The number of amplicons or regions")
+    parser.add_argument("-o", "--output_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to output file")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("-a", "--annotations", type=int, default=0,
+                        help="The number of additional annotation columns of coverage analysis results")
+    args = parser.parse_args(argv)
+    main(kind=args.kind, rows=args.rows, output_file=args.output_file, seed=args.seed, annotations=args.annotations)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,149 @@
+import argparse
+import hashlib
+import io
+import pathlib
+from dataclasses import dataclass
+from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
+from profiling import profiled
+
+
+def merge_intervals(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param starts: Start positions of intervals
+    :param ends: End positions of intervals (not inclusive)
+    :return: start and end positions of sorted merged intervals
+    """
+    if starts.shape[0] == 0:
+        return starts.astype(np.int64), ends.astype(np.int64)
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order].astype(np.int64)
+    ends = np.maximum.accumulate(ends[order].astype(np.int64))
+    # A new merged interval begins where the start is after all previous ends:
+    new = np.concatenate([[True], starts[1:] > ends[:-1]])
+    last = np.concatenate([np.flatnonzero(new)[1:] - 1, [starts.shape[0] - 1]])
+    return starts[new], ends[last]
+
+
+@dataclass
+class TargetCounts:
+    """
+    LQR positions in target regions, accumulated chunk by chunk. The number of LQR positions before each breakpoint
+    of a contig is a piecewise linear function of the breakpoint, kept as differences of its slope and offset, so
+    a chunk only adds its LQR starts and ends at their breakpoint indices.
+    """
+    index: "TargetIndex"
+    slopes: Dict[str, np.ndarray]
+    offsets: Dict[str, np.ndarray]
+
+    def add(self, lqr: pd.DataFrame):
+        """
+        :param lqr: pd.DataFrame with contig, start and stop (not inclusive) columns of non-overlapping LQRs
+        """
+        for contig, regions in lqr.groupby("contig", sort=False):
+            breakpoints = self.index.breakpoints.get(contig)
+            if breakpoints is None:
+                continue
+            size = breakpoints.shape[0] + 1
+            starts = regions["start"].to_numpy(dtype=np.int64)
+            stops = regions["stop"].to_numpy(dtype=np.int64)
+            # A LQR covers (breakpoint - start) positions before breakpoints after its start and its whole length
+            # before breakpoints after its end:
+            first = np.searchsorted(breakpoints, starts, side="left")
+            last = np.searchsorted(breakpoints, stops, side="left")
+            self.slopes[contig] += np.bincount(first, minlength=size) - np.bincount(last, minlength=size)
+            # Sums of positions in a chunk are exact in float64 (below 2^53)
+            self.offsets[contig] += np.rint(np.bincount(last, weights=stops, minlength=size) -
+                                            np.bincount(first, weights=starts, minlength=size)).astype(np.int64)
+
+    def lengths(self) -> np.ndarray:
+        """
+        :return: the number of LQR positions in each target region
+        """
+        lengths = np.zeros(self.index.targets.shape[0], dtype=np.int64)
+        for contig, (rows, start_index, end_index) in self.index.positions.items():
+            breakpoints = self.index.breakpoints[contig]
+            before = np.cumsum(self.slopes[contig])[:-1] * breakpoints + np.cumsum(self.offsets[contig])[:-1]
+            lengths[rows] = before[end_index] - before[start_index]
+        return lengths
+
+
+@dataclass
+class TargetIndex:
+    targets: pd.DataFrame
+    merged: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    # Sorted start and end positions of target regions of each contig
+    breakpoints: Dict[str, np.ndarray]
+    # Rows of target regions of each contig and the indices of their start and end positions in the breakpoints
+    positions: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]
+
+    @property
+    def merged_length(self) -> int:
+        """
+        :return: the number of positions in target regions without double counting of overlaps
+        """
+        return int(sum((ends - starts).sum() for starts, ends in self.merged.values()))
+
+    @property
+    def digest(self) -> str:
+        """
+        :return: SHA-256 of target regions
+        """
+        return hashlib.sha256(self.targets.to_csv(sep="\t", index=False).encode()).hexdigest()
+
+    def counts(self) -> TargetCounts:
+        """
+        :return: empty counts of LQR positions in target regions
+        """
+        return TargetCounts(index=self,
+                            slopes={contig: np.zeros(points.shape[0] + 1, dtype=np.int64)
+                                    for contig, points in self.breakpoints.items()},
+                            offsets={contig: np.zeros(points.shape[0] + 1, dtype=np.int64)
+                                     for contig, points in self.breakpoints.items()})
+
+
+def load_targets(bed_file: pathlib.PosixPath) -> TargetIndex:
+    """
+    :param bed_file: The path to a BED file with target regions
+    :return: TargetIndex with target regions, their sorted merged intervals and breakpoints for each contig
+    """
+    # Skip comments and the header lines of genome browsers:
+    with open(bed_file, "r") as f:
+        lines = [line for line in f if line.strip() and not line.startswith(("#", "track", "browser"))]
+    bed = pd.read_csv(io.StringIO("".join(lines)), sep="\t", header=None, dtype={0: str})
+    targets = pd.DataFrame({"contig": bed[0], "start": bed[1].astype(np.int64), "end": bed[2].astype(np.int64)})
+    # Use the name column of the BED file (amplicon or target name) if present:
+    targets["name"] = bed[3].astype(str) if bed.shape[1] > 3 else \
+        targets["contig"] + ":" + targets["start"].astype(str) + "-" + targets["end"].astype(str)
+    merged = {}
+    breakpoints = {}
+    positions = {}
+    for contig, regions in targets.groupby("contig", sort=False):
+        starts = regions["start"].to_numpy()
+        ends = regions["end"].to_numpy()
+        merged[contig] = merge_intervals(starts, ends)
+        breakpoints[contig] = np.unique(np.concatenate([starts, ends]))
+        positions[contig] = (regions.index.to_numpy(), np.searchsorted(breakpoints[contig], starts),
+                             np.searchsorted(breakpoints[contig], ends))
+    return TargetIndex(targets=targets, merged=merged, breakpoints=breakpoints, positions=positions)
+
+
+@profiled
+def main(input_file, output_file):
+    with open(output_file, "w") as f:
+        f.write(f"{load_targets(input_file).merged_length}\n")
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Script for counting the number of positions in target regions")
+    parser.add_argument("-i", "--input_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to BED file with target regions")
+    parser.add_argument("-o", "--output_file", type=lambda p: pathlib.Path(p).absolute(),
+                        help="The path to output file with the number of positions")
+    args = parser.parse_args(argv)
+    main(input_file=args.input_file, output_file=args.output_file)
+
+
+if __name__ == "__main__":
+    cli()
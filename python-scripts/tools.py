@@ -0,0 +1,56 @@
+import shlex
+import subprocess
+
+
+def count_mapped_reads(samtools: str, bam_file: str) -> int:
+    """
+    :param samtools: The command for samtools
+    :param bam_file: The path to a BAM file
+    :return: the number of mapped reads
+    """
+    result = subprocess.run(shlex.split(samtools) + ["view", "-c", "-F", "4", bam_file], check=True,
+                            capture_output=True, text=True)
+    return int(result.stdout)
+
+
+def subsample_bam(samtools: str, bam_file: str, fraction: float, output_file: str, seed: int = 0, threads: int = 1):
+    """
+    :param samtools: The command for samtools
+    :param bam_file: The path to a BAM file
+    :param fraction: The fraction of reads
+    :param output_file: The path to an output BAM file
+    :param seed: Subsampling seed (the integer part of samtools -s)
+    :param threads: The number of samtools threads
+    """
+    subprocess.run(shlex.split(samtools) + ["view", "-s", str(seed + fraction), "-b", "-@", str(threads), bam_file,
+                                            "-o", output_file], check=True)
+
+
+def run_sequtils(sequtils: str, target_file: str, bam_file: str, output_file: str):
+    """
+    :param sequtils: The command for sequtils
+    :param target_file: The path to BED file with target regions
+    :param bam_file: The path to a BAM file
+    :param output_file: The path to an output BED file
+    """
+    subprocess.run(shlex.split(sequtils) + ["regions", "-t", target_file, "-b", bam_file, "-o", output_file],
+                   check=True)
+
+
+def command_version(command: str) -> str:
+    """
+    :param command: The command for a tool
+    :return: the first line of the '<command> --version' output (empty if the tool does not report its version)
+    """
+    result = subprocess.run(shlex.split(command) + ["--version"], capture_output=True, text=True,
+                            stdin=subprocess.DEVNULL)
+    return result.stdout.splitlines()[0] if result.returncode == 0 and result.stdout else ""
+
+
+def tool_versions(samtools: str, sequtils: str) -> str:
+    """
+    :param samtools: The command for samtools
+    :param sequtils: The command for sequtils
+    :return: samtools version and the sequtils command, a part of result cache keys
+    """
+    return f"{command_version(samtools) or 'samtools'}; {sequtils}"